@@ -0,0 +1,164 @@
+"""Delivery engine for the asyncio SMTP transport.
+
+Same contract as delivery.DeliveryEngine, but the senders are tasks on one
+event loop, each holding an async_smtp session, so hundreds of SMTP sessions
+cost a coroutine each instead of a thread. Rendering still runs on a worker
+thread, a chunk of messages at a time, so it never stalls the loop.
+"""
+import asyncio
+import heapq
+import itertools
+
+from delivery import DeliveryEngine, DeliveryResult, recipients_of
+
+_STOP = object()
+
+# Messages pulled from the render generator per hop to the worker thread
+RENDER_CHUNK = 64
+
+
+class AsyncDeliveryEngine(DeliveryEngine):
+    """DeliveryEngine whose ``send(outbound, smtp)`` is a coroutine function.
+
+    ``pool`` is an async_smtp.AsyncSMTPPool. Retries, the rate limiter and
+    the adaptive concurrency cap behave as in DeliveryEngine; waiting on
+    them suspends the sender task rather than blocking a thread. The event
+    loop runs on the calling thread; ``thread_context`` wraps each render
+    hop to the worker thread.
+    """
+
+    def run(self, items, on_result):
+        """Deliver everything ``items`` yields; blocks until done (runs its own event loop)."""
+        asyncio.run(self._run(iter(items), on_result))
+
+    async def _run(self, items, on_result):
+        work = asyncio.Queue(maxsize=self.queue_size)
+        self._in_flight = 0
+        self._slot_free = asyncio.Condition()
+        self._stopping = False
+        loop = asyncio.get_running_loop()
+        self._sender_died = loop.create_future()
+        senders = [asyncio.ensure_future(self._sender(work, on_result)) for _ in range(self.workers)]
+        for sender in senders:
+            sender.add_done_callback(self._sender_stopped)
+
+        def next_chunk():
+            with self.thread_context():
+                return list(itertools.islice(items, RENDER_CHUNK))
+
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, next_chunk)
+                if not chunk:
+                    break
+                for item in chunk:
+                    if isinstance(item, DeliveryResult):
+                        on_result(item)
+                        continue
+                    await self._feed_due_retries_async(work)
+                    await self._enqueue_async(work, item, 0)
+
+            # Wait for in-flight sends, feeding retries as they come due
+            while True:
+                with self._lock:
+                    if not self._outstanding and not self._retry_heap:
+                        break
+                    next_due = self._retry_heap[0][0] if self._retry_heap else None
+                self._raise_failure()
+                if not await self._feed_due_retries_async(work):
+                    delay = 0.05 if next_due is None else next_due - self.clock()
+                    await asyncio.sleep(min(max(delay, 0.01), 0.05))
+        except BaseException:
+            for sender in senders:
+                sender.cancel()
+            await asyncio.gather(*senders, return_exceptions=True)
+            raise
+        self._stopping = True
+        for _ in senders:
+            await work.put(_STOP)
+        await asyncio.gather(*senders)
+
+    def _sender_stopped(self, sender):
+        """Done callback of a sender task: record why it stopped, if it was not told to."""
+        if sender.cancelled():
+            return
+        failure = sender.exception()
+        if failure is None and not self._stopping:
+            failure = RuntimeError("An SMTP sender task stopped early")
+        if failure is None:
+            return
+        with self._lock:
+            if self._failure is None:
+                self._failure = failure
+        if not self._sender_died.done():
+            self._sender_died.set_result(None)
+
+    async def _enqueue_async(self, work, item, attempt):
+        with self._lock:
+            self._outstanding += 1
+        self._raise_failure()
+        if not work.full():
+            work.put_nowait((item, attempt))
+            return
+        # A full queue with dead senders would block forever; wait for whichever comes first
+        put = asyncio.ensure_future(work.put((item, attempt)))
+        try:
+            await asyncio.wait([put, self._sender_died], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            put.cancel() # No-op once the put went through
+        self._raise_failure()
+
+    async def _feed_due_retries_async(self, work):
+        fed = False
+        while True:
+            with self._lock:
+                if not self._retry_heap or self._retry_heap[0][0] > self.clock():
+                    return fed
+                _, _, item, attempt = heapq.heappop(self._retry_heap)
+            await self._enqueue_async(work, item, attempt)
+            fed = True
+
+    async def _sender(self, work, report):
+        async with self.pool.session() as session:
+            while True:
+                entry = await work.get()
+                if entry is _STOP:
+                    return
+                item, attempt = entry
+                try:
+                    for result in await self._attempt_async(item, attempt, session):
+                        report(result)
+                finally:
+                    with self._lock:
+                        self._outstanding -= 1
+
+    async def _attempt_async(self, item, attempt, session):
+        await self._acquire_slot()
+        try:
+            if self.rate_limiter:
+                tokens = len(recipients_of(item))
+                wait = self.rate_limiter.try_acquire(tokens)
+                while wait > 0:
+                    await asyncio.sleep(wait)
+                    wait = self.rate_limiter.try_acquire(tokens)
+            outcome = await self.send(item, session)
+        except Exception as e:
+            return self._send_failed(item, attempt, e)
+        finally:
+            await self._release_slot()
+        return self._sent(item, outcome)
+
+    async def _acquire_slot(self):
+        if self.concurrency is None:
+            return
+        async with self._slot_free:
+            # The limit shrinks on backoff and regrows on success
+            await self._slot_free.wait_for(lambda: self._in_flight < self.concurrency.limit)
+            self._in_flight += 1
+
+    async def _release_slot(self):
+        if self.concurrency is None:
+            return
+        async with self._slot_free:
+            self._in_flight -= 1
+            self._slot_free.notify_all()
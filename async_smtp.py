@@ -0,0 +1,390 @@
+"""Asyncio SMTP transport for very high fan-out.
+
+A small SMTP client (EHLO, STARTTLS or implicit TLS, AUTH PLAIN/LOGIN,
+PIPELINING) on asyncio streams, so hundreds of sessions can share one event
+loop instead of needing a thread each. Every command runs under a timeout,
+and a cancelled task simply drops its connection.
+
+It raises the same smtplib exceptions as the blocking path, so send errors
+are classified and reported the same way for both transports.
+"""
+import asyncio
+import base64
+import smtplib
+import socket
+import ssl
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+from metrics import count_smtp_replies, timed
+
+CRLF = b"\r\n"
+
+
+@lru_cache(maxsize=1)
+def _local_hostname():
+    # Resolved once; smtplib does this lookup for every connection
+    return socket.getfqdn()
+
+
+async def _within(timeout, awaitable):
+    """Await ``awaitable``, raising socket.timeout like smtplib if it takes longer."""
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise socket.timeout("timed out") from None
+
+
+def _dot_stuff(msg):
+    """Escape leading dots and terminate the DATA payload (see smtplib.SMTP.data)."""
+    data = msg.replace(CRLF + b".", CRLF + b"..")
+    if data.startswith(b"."):
+        data = b"." + data
+    if not data.endswith(CRLF):
+        data += CRLF
+    return data + b"." + CRLF
+
+
+class AsyncSMTPConnection:
+    """One SMTP connection on asyncio streams."""
+
+    def __init__(self, host, port, timeout=30, starttls=None, ssl_context=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.implicit_tls = port == 465
+        self.starttls_required = (not self.implicit_tls) if starttls is None else starttls
+        self.ssl_context = ssl_context
+        self.extensions = {}
+        self._reader = None
+        self._writer = None
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    async def connect(self):
+        tls = (self.ssl_context or ssl.create_default_context()) if self.implicit_tls else None
+        self._reader, self._writer = await _within(
+            self.timeout, asyncio.open_connection(self.host, self.port, ssl=tls,
+                                                  server_hostname=self.host if tls else None))
+        code, message = await self._read_reply()
+        if code != 220:
+            self.close()
+            raise smtplib.SMTPConnectError(code, message)
+        await self.ehlo()
+        if self.starttls_required:
+            await self.starttls()
+
+    async def ehlo(self):
+        code, message = await self.command(f"EHLO {_local_hostname()}")
+        if code != 250:
+            raise smtplib.SMTPHeloError(code, message)
+        self.extensions = {}
+        for line in message.decode("latin-1").splitlines()[1:]:
+            name, _, params = line.partition(" ")
+            self.extensions[name.lower()] = params
+
+    async def starttls(self):
+        if "starttls" not in self.extensions:
+            raise smtplib.SMTPNotSupportedError("STARTTLS extension not supported by server.")
+        code, message = await self.command("STARTTLS")
+        if code != 220:
+            raise smtplib.SMTPResponseException(code, message)
+        context = self.ssl_context or ssl.create_default_context()
+        if hasattr(self._writer, "start_tls"): # Python 3.11+
+            await _within(self.timeout, self._writer.start_tls(context, server_hostname=self.host))
+        else:
+            # The protocol keeps feeding the same reader once TLS is up; only
+            # writes need the new transport, so the writer is replaced
+            loop = asyncio.get_running_loop()
+            transport = self._writer.transport
+            protocol = transport.get_protocol()
+            tls_transport = await _within(
+                self.timeout, loop.start_tls(transport, protocol, context, server_hostname=self.host))
+            self._writer = asyncio.StreamWriter(tls_transport, protocol, self._reader, loop)
+        await self.ehlo() # Re-identify after starting TLS
+
+    async def login(self, username, password):
+        methods = self.extensions.get("auth", "").upper().split()
+        if "PLAIN" in methods:
+            token = base64.b64encode(f"\0{username}\0{password}".encode("utf-8")).decode("ascii")
+            code, message = await self.command(f"AUTH PLAIN {token}")
+        elif "LOGIN" in methods:
+            code, message = await self.command("AUTH LOGIN")
+            if code == 334:
+                code, message = await self.command(base64.b64encode(username.encode("utf-8")).decode("ascii"))
+            if code == 334:
+                code, message = await self.command(base64.b64encode(password.encode("utf-8")).decode("ascii"))
+        else:
+            raise smtplib.SMTPNotSupportedError("No suitable authentication method found.")
+        if code != 235:
+            raise smtplib.SMTPAuthenticationError(code, message)
+
+    async def noop(self):
+        return await self.command("NOOP")
+
+    async def sendmail(self, from_addr, to_addrs, msg):
+        """Send ``msg`` (bytes) and return smtplib's dict of refused recipients.
+
+        Raises SMTPSenderRefused, SMTPRecipientsRefused (when every recipient
+        was refused) or SMTPDataError like smtplib.SMTP.sendmail.
+        """
+        if isinstance(to_addrs, str):
+            to_addrs = [to_addrs]
+        envelope = [f"MAIL FROM:{smtplib.quoteaddr(from_addr)}"]
+        envelope += [f"RCPT TO:{smtplib.quoteaddr(addr)}" for addr in to_addrs]
+        pipelined = "pipelining" in self.extensions
+        if pipelined:
+            # Envelope and DATA in a single round trip (RFC 2920)
+            await self._write(*envelope, "DATA")
+            replies = [await self._read_reply() for _ in range(len(envelope) + 1)]
+            data_reply = replies.pop()
+        else:
+            replies = [await self.command(envelope[0])]
+
+        code, message = replies[0]
+        if code != 250:
+            await self._abandon(code, data_reply if pipelined else None)
+            raise smtplib.SMTPSenderRefused(code, message, from_addr)
+        if not pipelined:
+            replies += [await self.command(command) for command in envelope[1:]]
+        refused = {}
+        for addr, (code, message) in zip(to_addrs, replies[1:]):
+            if code not in (250, 251):
+                refused[addr] = (code, message)
+            if code == 421:
+                self.close()
+                raise smtplib.SMTPRecipientsRefused(refused)
+        if len(refused) == len(to_addrs):
+            await self._abandon(None, data_reply if pipelined else None)
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        code, message = data_reply if pipelined else await self.command("DATA")
+        if code != 354:
+            await self._abandon(code)
+            raise smtplib.SMTPDataError(code, message)
+        await self._write_raw(_dot_stuff(msg))
+        code, message = await self._read_reply()
+        if code != 250:
+            await self._abandon(code)
+            raise smtplib.SMTPDataError(code, message)
+        return refused
+
+    async def _abandon(self, code, data_reply=None):
+        """Clean up after a refused transaction: drop the connection on 421, else RSET."""
+        if code == 421:
+            self.close()
+            return
+        if data_reply is not None and data_reply[0] == 354:
+            # A pipelined DATA was accepted anyway; end it with an empty body
+            try:
+                await self.command(".")
+            except (smtplib.SMTPServerDisconnected, OSError):
+                return
+        await self._rset()
+
+    async def quit(self):
+        try:
+            await self.command("QUIT")
+        except (smtplib.SMTPException, OSError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self._writer is not None:
+            writer, self._writer, self._reader = self._writer, None, None
+            writer.close()
+
+    async def command(self, line):
+        await self._write(line)
+        return await self._read_reply()
+
+    async def _rset(self):
+        try:
+            await self.command("RSET")
+        except (smtplib.SMTPServerDisconnected, OSError):
+            pass
+
+    async def _write(self, *lines):
+        await self._write_raw(b"".join(line.encode("ascii") + CRLF for line in lines))
+
+    async def _write_raw(self, data):
+        if self._writer is None:
+            raise smtplib.SMTPServerDisconnected("please run connect() first")
+        self._writer.write(data)
+        await _within(self.timeout, self._writer.drain())
+
+    async def _read_reply(self):
+        if self._reader is None:
+            raise smtplib.SMTPServerDisconnected("please run connect() first")
+        lines = []
+        while True:
+            line = await _within(self.timeout, self._reader.readline())
+            if not line:
+                self.close()
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            lines.append(line[4:].rstrip(b"\r\n"))
+            try:
+                code = int(line[:3])
+            except ValueError:
+                self.close()
+                raise smtplib.SMTPServerDisconnected(f"Malformed reply: {line!r}") from None
+            if line[3:4] != b"-":
+                return code, b"\n".join(lines)
+
+
+class AsyncPooledSession:
+    """Async counterpart of smtp_pool.PooledSMTPSession, with the same recycling rules."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.connection = None
+        self.message_count = 0
+        self.last_used = 0.0
+
+    @property
+    def connected(self):
+        return self.connection is not None and self.connection.connected
+
+    async def connect(self):
+        self.close()
+        pool = self.pool
+        connection = AsyncSMTPConnection(pool.host, pool.port, timeout=pool.timeout,
+                                         starttls=pool.starttls, ssl_context=pool.ssl_context)
+        try:
+            with timed(pool.metrics, "smtp_connect"):
+                await connection.connect()
+            if pool.username:
+                with timed(pool.metrics, "smtp_login"):
+                    await connection.login(pool.username, pool.password)
+        except BaseException:
+            connection.close()
+            raise
+        self.connection = connection
+        self.message_count = 0
+        self.last_used = pool.clock()
+        pool.connections_opened += 1
+
+    def close(self):
+        if self.connection is not None:
+            connection, self.connection = self.connection, None
+            connection.close()
+
+    async def quit(self):
+        if self.connection is not None:
+            connection, self.connection = self.connection, None
+            await connection.quit()
+
+    async def ensure_ready(self):
+        pool = self.pool
+        if not self.connected:
+            await self.connect()
+            return
+        if pool.max_messages and self.message_count >= pool.max_messages:
+            await self.quit()
+            await self.connect()
+            return
+        if pool.keepalive_interval is not None and pool.clock() - self.last_used >= pool.keepalive_interval:
+            try:
+                code, _ = await self.connection.noop()
+            except (smtplib.SMTPException, OSError):
+                code = None
+            if code != 250:
+                await self.connect()
+            else:
+                self.last_used = pool.clock()
+
+    async def sendmail(self, from_addr, to_addrs, msg):
+        """Send one message; a reused session that was dropped is reopened and retried once."""
+        await self.ensure_ready()
+        reused = self.message_count > 0
+        metrics = self.pool.metrics
+        try:
+            with timed(metrics, "smtp_send"):
+                refused = await self.connection.sendmail(from_addr, to_addrs, msg)
+        except smtplib.SMTPServerDisconnected as e:
+            self.close()
+            if not reused:
+                count_smtp_replies(metrics, error=e)
+                raise
+            self.pool.reconnects += 1
+            await self.connect()
+            try:
+                with timed(metrics, "smtp_send"):
+                    refused = await self.connection.sendmail(from_addr, to_addrs, msg)
+            except Exception as retry_error:
+                count_smtp_replies(metrics, error=retry_error)
+                if not self.connected:
+                    self.close()
+                raise
+        except smtplib.SMTPException as e:
+            count_smtp_replies(metrics, error=e)
+            if not self.connection.connected:
+                self.close() # The server answered 421 and the connection was dropped
+            raise
+        except Exception as e:
+            # A dropped socket, or a failure (e.g. UnicodeEncodeError) somewhere
+            # mid-transaction: RSET could land inside DATA, so start over
+            count_smtp_replies(metrics, error=e)
+            self.close()
+            raise
+        except BaseException:
+            self.close() # Cancelled mid-transaction
+            raise
+        count_smtp_replies(metrics, refused)
+        self.message_count += 1
+        self.last_used = self.pool.clock()
+        return refused
+
+
+class AsyncSMTPPool:
+    """Settings and counters for AsyncPooledSessions on one event loop.
+
+    Each sender task checks out a session for its lifetime with
+    ``async with pool.session()``; at most ``size`` are open at once.
+    """
+
+    def __init__(self, host, port, username=None, password=None, size=1,
+                 max_messages=100, keepalive_interval=30, timeout=30,
+                 starttls=None, ssl_context=None, clock=time.monotonic, metrics=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = max(1, int(size))
+        self.max_messages = max_messages
+        self.keepalive_interval = keepalive_interval
+        self.timeout = timeout
+        self.starttls = port != 465 if starttls is None else starttls
+        self.ssl_context = ssl_context
+        self.clock = clock
+        self.metrics = metrics
+
+        self.connections_opened = 0
+        self.reconnects = 0
+        self._slots = None
+        self._closed = False
+
+    @asynccontextmanager
+    async def session(self):
+        if self._closed:
+            raise RuntimeError("SMTP connection pool is closed")
+        if self._slots is None:
+            # Created lazily so it binds to the running loop
+            self._slots = asyncio.Semaphore(self.size)
+        async with self._slots:
+            session = AsyncPooledSession(self)
+            try:
+                yield session
+            except BaseException:
+                session.close()
+                raise
+            else:
+                await session.quit()
+
+    def close(self):
+        """Refuse new sessions; open ones are closed by the tasks that hold them."""
+        self._closed = True
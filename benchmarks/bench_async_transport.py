@@ -0,0 +1,129 @@
+"""Compare the blocking (thread per session) and asyncio SMTP transports.
+
+Sends the same messages through DeliveryEngine + SMTPConnectionPool and
+through AsyncDeliveryEngine + AsyncSMTPPool against the local sink, which
+waits ``--latency-ms`` before accepting each message to stand in for a
+remote relay. Each transport runs in a fresh child process so its peak RSS
+can be reported on its own. Usage::
+
+    pip install aiosmtpd
+    python benchmarks/bench_async_transport.py --messages 5000 --sessions 200
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from delivery import OutboundEmail  # noqa: E402
+from mime_parts import build_message  # noqa: E402
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _outbound(messages):
+    body = "<p>Hello there, this is a benchmark message.</p>" * 40
+    for i in range(messages):
+        yield OutboundEmail(i + 2, f"user{i}@example.com", f"Benchmark {i}", body, "plain text")
+
+
+def run_transport(transport, port, messages, sessions):
+    """Child process body: deliver ``messages`` and return the measurements."""
+    from async_delivery import AsyncDeliveryEngine
+    from async_smtp import AsyncSMTPPool
+    from delivery import DeliveryEngine
+    from smtp_pool import SMTPConnectionPool
+
+    def payload(item):
+        return build_message("Bench <bench@example.com>", item.receiver, item.subject,
+                             item.plain_body, item.html_body)
+
+    def send(item, smtp):
+        smtp.sendmail("bench@example.com", item.receiver, payload(item))
+        return True, "sent"
+
+    async def send_async(item, smtp):
+        await smtp.sendmail("bench@example.com", item.receiver, payload(item))
+        return True, "sent"
+
+    if transport == "asyncio":
+        pool = AsyncSMTPPool("127.0.0.1", port, username="bench", password="bench",
+                             size=sessions, starttls=False, max_messages=0)
+        engine = AsyncDeliveryEngine(pool, send_async, workers=sessions)
+    else:
+        pool = SMTPConnectionPool("127.0.0.1", port, username="bench", password="bench",
+                                  size=sessions, starttls=False, max_messages=0)
+        engine = DeliveryEngine(pool, send, workers=sessions)
+
+    failures = []
+
+    def record(result):
+        if not result.success:
+            failures.append(result.message)
+
+    baseline_rss = _peak_rss_mb()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    engine.run(_outbound(messages), record)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    pool.close()
+    return {
+        "transport": transport,
+        "messages": messages,
+        "sessions": sessions,
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(messages / elapsed, 1),
+        "cpu_ms_per_message": round(cpu * 1000 / messages, 3),
+        "failed": len(failures),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "rss_growth_mb": round(_peak_rss_mb() - baseline_rss, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=20.0,
+                        help="Delay the sink adds before accepting each message")
+    parser.add_argument("--child", nargs=2, metavar=("TRANSPORT", "PORT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        transport, port = args.child
+        print(json.dumps(run_transport(transport, int(port), args.messages, args.sessions)))
+        return
+
+    from smtp_sink import CountingHandler, SMTPSink
+
+    results = []
+    with SMTPSink(CountingHandler(delay=args.latency_ms / 1000)) as sink:
+        for transport in ("threads", "asyncio"):
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--messages", str(args.messages),
+                 "--sessions", str(args.sessions), "--child", transport, str(sink.port)],
+                check=True, capture_output=True, text=True,
+            )
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    for result in results:
+        print(f"{result['transport']:>8}: {result['messages_per_second']:8.1f} msg/s, "
+              f"{result['cpu_ms_per_message']:.3f} ms CPU/msg, "
+              f"peak RSS {result['peak_rss_mb']:6.1f} MB (+{result['rss_growth_mb']} MB while sending), "
+              f"{result['failed']} failed")
+    threads, async_ = results
+    print(f" speedup: {async_['messages_per_second'] / threads['messages_per_second']:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""End-to-end benchmark of the bulk send path, for comparing commits.
+
+Each scenario generates a synthetic CSV (rows x columns), a template (HTML,
+Markdown or plain text) with a placeholder for every column, and optionally
+an attachment, then posts them to ``index()`` through Flask's test client
+exactly like the form does and waits for the campaign to finish against the
+local sink. Scenarios run in fresh child processes so peak RSS is their own.
+
+Reports rows/sec, per-stage latency percentiles (from the campaign's
+metrics) and peak memory, and writes everything as JSON; ``--compare``
+prints the rows/sec change against an earlier run. Usage::
+
+    pip install aiosmtpd
+    python benchmarks/bench_bulk.py --output before.json
+    git checkout my-branch
+    python benchmarks/bench_bulk.py --output after.json --compare before.json
+    python benchmarks/bench_bulk.py --rows 1000 --columns 5 --attachment-kb 0  # quick run
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TEMPLATE_EXTENSIONS = {"html": "html", "markdown": "md", "plain": "txt"}
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _int_list(text):
+    return [int(value) for value in text.split(",") if value.strip()]
+
+
+def _str_list(text):
+    return [value.strip() for value in text.split(",") if value.strip()]
+
+
+def _headers(columns):
+    return ["email"] + [f"field_{i:02d}" for i in range(1, max(columns, 1))]
+
+
+def write_csv(path, rows, columns):
+    """``rows`` recipients with ``columns`` columns (email first), streamed to ``path``."""
+    headers = _headers(columns)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        f.write(",".join(headers) + "\n")
+        for r in range(rows):
+            values = [f"user{r}@example.com"] + [f"value-{r}-{c}" for c in range(1, len(headers))]
+            f.write(",".join(values) + "\n")
+
+
+def write_template(path, kind, columns):
+    """A ~4 KB template of ``kind`` using every column at least once."""
+    fields = _headers(columns)[1:]
+    placeholders = " ".join(f"${{{field}}}" for field in fields)
+    filler = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor. " * 6
+    if kind == "html":
+        paragraphs = "".join(f"<p>{filler}</p>\n" for _ in range(6))
+        text = (f"<html><head><title>Hello $field_01</title></head><body>\n"
+                f"<h1>Dear $field_01</h1>\n<p>{placeholders}</p>\n{paragraphs}"
+                f"<p><a href=\"https://example.com/u/$field_01\">Unsubscribe</a></p>\n</body></html>\n")
+    elif kind == "markdown":
+        items = "".join(f"* **{field}**: ${field}\n" for field in fields[:20])
+        text = (f"Hello $field_01\n\n# Dear $field_01\n\n{placeholders}\n\n{items}\n"
+                + "".join(f"{filler}\n\n" for _ in range(6))
+                + "[Unsubscribe](https://example.com/u/$field_01)\n")
+    else:
+        text = (f"Hello $field_01\n\nDear $field_01,\n\n{placeholders}\n\n"
+                + "".join(f"{filler}\n\n" for _ in range(6)))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def write_attachment(path, size_kb, seed):
+    with open(path, "wb") as f:
+        size = size_kb * 1024
+        f.write(random.Random(seed).getrandbits(size * 8).to_bytes(size, "little"))
+
+
+def run_scenario(scenario, port, workdir):
+    """Child process body: send one scenario through index() and return the measurements."""
+    os.environ.update({
+        "sender_email": "bench@example.com", "password": "bench",
+        "MAILER_HOST": "127.0.0.1", "MAILER_PORT": str(port), "SMTP_STARTTLS": "false",
+        "SMTP_TRANSPORT": scenario["transport"],
+        "MAX_SEND_WORKERS": str(max(scenario["workers"], 1)),
+        "CAMPAIGN_DATA_DIR": os.path.join(workdir, "campaigns"),
+    })
+    sys.path.insert(0, ROOT)
+    import app as bulk_app
+
+    name = scenario["name"]
+    csv_path = os.path.join(workdir, f"{name}.csv")
+    template_path = os.path.join(workdir, f"{name}.{TEMPLATE_EXTENSIONS[scenario['template']]}")
+    write_csv(csv_path, scenario["rows"], scenario["columns"])
+    write_template(template_path, scenario["template"], scenario["columns"])
+    form = {
+        "template_source": "upload",
+        "send_method": "bulk",
+        "send_workers": str(scenario["workers"]),
+        "template_file": (open(template_path, "rb"), os.path.basename(template_path)),
+        "csv_file": (open(csv_path, "rb"), "recipients.csv"),
+    }
+    if scenario["attachment_kb"]:
+        attachment_path = os.path.join(workdir, f"{name}.bin")
+        write_attachment(attachment_path, scenario["attachment_kb"], seed=scenario["attachment_kb"])
+        form["attachments"] = [(open(attachment_path, "rb"), "report.bin")]
+
+    client = bulk_app.app.test_client()
+    baseline_rss = _peak_rss_mb()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    response = client.post("/", data=form, content_type="multipart/form-data",
+                           headers={"Accept": "application/json"})
+    if response.status_code != 202:
+        raise RuntimeError(f"index() answered {response.status_code}: {response.get_data(as_text=True)[:500]}")
+    job = bulk_app.campaign_jobs.get(response.get_json()["job_id"])
+    while not job.finished:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    if job.error:
+        raise RuntimeError(f"campaign failed: {job.error}")
+
+    return {
+        **scenario,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(scenario["rows"] / elapsed, 1),
+        "cpu_ms_per_row": round(cpu * 1000 / scenario["rows"], 3),
+        "sent": job.sent,
+        "failed": job.failed,
+        "skipped": job.skipped,
+        "stages": {
+            row["stage"]: {**{key: round(row[key], 4) for key in ("mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms")},
+                           "count": row["count"], "total_seconds": round(row["total_seconds"], 3)}
+            for row in job.metrics.stage_summary()
+        },
+        "smtp_replies": {dict(labels)["code"]: count
+                         for labels, count in job.metrics.counters("smtp_replies").items()},
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "rss_growth_mb": round(_peak_rss_mb() - baseline_rss, 1),
+    }
+
+
+def build_scenarios(args):
+    scenarios = []
+    for rows in args.rows:
+        for columns in args.columns:
+            for template in args.templates:
+                for attachment_kb in args.attachment_kb:
+                    scenarios.append({
+                        "name": f"{rows}r-{columns}c-{template}-{attachment_kb}kb",
+                        "rows": rows,
+                        "columns": columns,
+                        "template": template,
+                        "attachment_kb": attachment_kb,
+                        "transport": args.transport,
+                        "workers": args.workers,
+                    })
+    return scenarios
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, baseline=None):
+    previous = {result["name"]: result for result in (baseline or {}).get("scenarios", [])}
+    for result in results:
+        stages = result["stages"]
+        slowest = sorted(stages, key=lambda stage: stages[stage]["total_seconds"], reverse=True)[:3]
+        line = (f"{result['name']:>28}: {result['rows_per_second']:9.1f} rows/s, "
+                f"{result['cpu_ms_per_row']:.3f} ms CPU/row, peak RSS {result['peak_rss_mb']:6.1f} MB, "
+                f"{result['failed']} failed")
+        if result["name"] in previous:
+            before = previous[result["name"]]["rows_per_second"]
+            line += f", {(result['rows_per_second'] / before - 1) * 100:+6.1f}% vs baseline"
+        print(line)
+        print(" " * 30 + "  ".join(f"{stage} p95 {stages[stage]['p95_ms']:.3f} ms" for stage in slowest))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=_int_list, default=[1000, 10000, 100000],
+                        help="Comma-separated row counts")
+    parser.add_argument("--columns", type=_int_list, default=[5, 100], help="Comma-separated column counts")
+    parser.add_argument("--templates", type=_str_list, default=list(TEMPLATE_EXTENSIONS),
+                        help="Comma-separated template kinds: html, markdown, plain")
+    parser.add_argument("--attachment-kb", type=_int_list, default=[0, 256],
+                        help="Comma-separated attachment sizes in KB (0 = no attachment)")
+    parser.add_argument("--transport", choices=("threads", "asyncio"), default="threads")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel SMTP senders")
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="Delay the sink adds before accepting each message")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Earlier --output file to compare rows/sec against")
+    parser.add_argument("--child", nargs=3, metavar=("SCENARIO", "PORT", "WORKDIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        scenario, port, workdir = args.child
+        print(json.dumps(run_scenario(json.loads(scenario), int(port), workdir)))
+        return
+
+    unknown = set(args.templates) - set(TEMPLATE_EXTENSIONS)
+    if unknown:
+        parser.error(f"unknown template kind(s): {', '.join(sorted(unknown))}")
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from smtp_sink import CountingHandler, SMTPSink
+
+    results = []
+    with SMTPSink(CountingHandler(delay=args.latency_ms / 1000)) as sink:
+        for scenario in build_scenarios(args):
+            with tempfile.TemporaryDirectory(prefix="bench-bulk-") as workdir:
+                out = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__),
+                     "--child", json.dumps(scenario), str(sink.port), workdir],
+                    check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+                )
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+            print(f"{scenario['name']}: {results[-1]['rows_per_second']} rows/s", file=sys.stderr)
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "sink_latency_ms": args.latency_ms,
+        "scenarios": results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
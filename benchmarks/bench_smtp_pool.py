@@ -0,0 +1,59 @@
+"""Compare pooled SMTP sessions with the connect-per-message path.
+
+Runs against the local sink in smtp_sink.py, so it measures the client side
+of the handshake cost (EHLO + AUTH + QUIT per message) rather than anything a
+real relay does. Usage::
+
+    pip install aiosmtpd
+    python benchmarks/bench_smtp_pool.py --messages 2000
+"""
+import argparse
+import os
+import sys
+import time
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smtp_pool import SMTPConnectionPool  # noqa: E402
+from smtp_sink import SMTPSink  # noqa: E402
+
+
+def _message(i):
+    msg = MIMEText(f"<p>Hello recipient {i}</p>" * 20, "html", "utf-8")
+    msg["Subject"] = f"Benchmark {i}"
+    msg["From"] = "Bench <bench@example.com>"
+    msg["To"] = f"user{i}@example.com"
+    return msg.as_string()
+
+
+def run(sink, messages, max_messages):
+    pool = SMTPConnectionPool(sink.host, sink.port, username="bench", password="bench",
+                              max_messages=max_messages, starttls=False)
+    payloads = [_message(i) for i in range(messages)]
+    start = time.perf_counter()
+    with pool:
+        for i, payload in enumerate(payloads):
+            pool.sendmail("bench@example.com", f"user{i}@example.com", payload)
+    elapsed = time.perf_counter() - start
+    return messages / elapsed, pool.connections_opened
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--max-messages-per-connection", type=int, default=100)
+    args = parser.parse_args()
+
+    with SMTPSink() as sink:
+        # max_messages=1 reproduces send_email's connect/login/quit per recipient
+        baseline, baseline_conns = run(sink, args.messages, 1)
+        pooled, pooled_conns = run(sink, args.messages, args.max_messages_per_connection)
+
+    print(f"connect-per-message: {baseline:8.1f} msg/s ({baseline_conns} connections)")
+    print(f"pooled sessions:     {pooled:8.1f} msg/s ({pooled_conns} connections)")
+    print(f"speedup:             {pooled / baseline:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
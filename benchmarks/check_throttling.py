@@ -0,0 +1,236 @@
+"""Deterministic checks of rate limiting, adaptive concurrency and retries.
+
+RateLimiter, AdaptiveConcurrency and DeliveryEngine's retry heap run against
+a fake clock, so backoffs and quota waits are checked without sleeping. The last
+check sends through mailer.send_email and a pooled session to FlakyHandler,
+a local relay answering 451 to each recipient's first attempts, and expects
+every message to arrive after exactly the injected number of retries; then
+direct delivery to two domains checks that only the throttling domain's
+concurrency backs off. Finally, both delivery engines must re-raise, not
+hang, when an on_result callback kills every sender mid-feed.
+Exits non-zero on the first mismatch. Usage::
+
+    pip install aiosmtpd
+    python benchmarks/check_throttling.py
+"""
+import os
+import random
+import smtplib
+import sys
+import tempfile
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from async_delivery import AsyncDeliveryEngine  # noqa: E402
+from delivery import DeliveryEngine, OutboundEmail, TransientDeliveryError  # noqa: E402
+from throttle import AdaptiveConcurrency, RateLimiter  # noqa: E402
+
+
+class FakeClock:
+    """Monotonic clock that only moves when something sleeps on it."""
+
+    def __init__(self):
+        self.now = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            return self.now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.now += max(0.0, seconds)
+
+
+class NullPool:
+    @contextmanager
+    def session(self):
+        yield None
+
+
+class AsyncNullPool:
+    @asynccontextmanager
+    async def session(self):
+        yield None
+
+
+def expect(condition, description):
+    if not condition:
+        raise SystemExit(f"FAILED: {description}")
+    print(f"ok: {description}")
+
+
+def check_rate_limiter():
+    clock = FakeClock()
+    limiter = RateLimiter(per_second=10, clock=clock, sleep=clock.sleep)
+    for _ in range(100):
+        limiter.acquire()
+    # The bucket starts full: 10 at once, then the other 90 at 10 per second
+    expect(abs(clock.now - 9.0) < 1e-6, f"100 sends at 10/s take 9.0s of fake time (took {clock.now:.6f}s)")
+
+    clock = FakeClock()
+    limiter = RateLimiter(per_second=10, per_minute=30, clock=clock, sleep=clock.sleep)
+    for _ in range(60):
+        limiter.acquire()
+    # The per-minute quota dominates: 30 at once, then 30 more over a minute
+    expect(abs(clock.now - 60.0) < 1e-6, f"60 sends at 10/s and 30/min take 60.0s (took {clock.now:.6f}s)")
+
+    clock = FakeClock()
+    limiter = RateLimiter(per_second=5, clock=clock, sleep=clock.sleep)
+    limiter.acquire(5)
+    expect(limiter.try_acquire(5) == 1.0, "a batch of 5 after an empty bucket waits 1.0s at 5/s")
+
+
+def check_adaptive_concurrency():
+    concurrency = AdaptiveConcurrency(8)
+    concurrency.backoff()
+    expect(concurrency.limit == 4, "one backoff halves the cap from 8 to 4")
+    concurrency.backoff()
+    concurrency.backoff()
+    concurrency.backoff()
+    expect(concurrency.limit == 1, "repeated backoffs stop at the minimum of 1")
+    for _ in range(1 + 2 + 3 + 4):
+        concurrency.succeeded()
+    expect(concurrency.limit == 5, "1+2+3+4 successes in a row grow the cap back to 5")
+
+
+def check_retry_heap():
+    random.seed(1) # The backoff jitter
+    clock = FakeClock()
+    attempts = {}
+    lock = threading.Lock()
+
+    def send(item, smtp):
+        with lock:
+            attempts[item.receiver] = attempts.get(item.receiver, 0) + 1
+            attempt = attempts[item.receiver]
+        if item.receiver.startswith("flaky") and attempt <= 2:
+            raise TransientDeliveryError("451 try again later", 451)
+        if item.receiver.startswith("dead"):
+            raise TransientDeliveryError("421 service not available", 421)
+        return True, f"sent on attempt {attempt}"
+
+    concurrency = AdaptiveConcurrency(4)
+    engine = DeliveryEngine(NullPool(), send, workers=4, concurrency=concurrency, max_retries=3,
+                            retry_backoff=10.0, max_backoff=25.0, clock=clock, sleep=clock.sleep)
+    items = ([OutboundEmail(i, f"ok{i}@example.com", "s", "h") for i in range(10)]
+             + [OutboundEmail(100 + i, f"flaky{i}@example.com", "s", "h") for i in range(5)]
+             + [OutboundEmail(200, "dead@example.com", "s", "h")])
+    results = []
+    engine.run(items, results.append)
+
+    by_receiver = {result.receiver: result for result in results}
+    expect(len(results) == 16, "every recipient gets exactly one final result")
+    expect(all(by_receiver[f"ok{i}@example.com"].success for i in range(10)), "healthy recipients are sent first time")
+    expect(all(attempts[f"flaky{i}@example.com"] == 3 and by_receiver[f"flaky{i}@example.com"].success
+               for i in range(5)), "recipients refused twice succeed on their third attempt")
+    expect(attempts["dead@example.com"] == 4 and not by_receiver["dead@example.com"].success
+           and "gave up after 4 attempts" in by_receiver["dead@example.com"].message,
+           "a recipient refused every time fails after max_retries + 1 attempts")
+    expect(engine.retries == 5 * 2 + 3, f"13 retries were scheduled (got {engine.retries})")
+    # Backoff doubles from 10s (capped at 25s), +-20% jitter: the dead address
+    # cannot give up before 0.8 * (10 + 20 + 25) = 44s. (The engine's polling
+    # also advances the fake clock while real sender threads work, so only
+    # the lower bound is exact.)
+    expect(clock.now >= 44.0, f"retries waited out their backoff in fake time ({clock.now:.1f}s)")
+    expect(concurrency.limit < 4, f"4xx replies backed the concurrency cap off (now {concurrency.limit})")
+
+
+def check_flaky_relay():
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from smtp_sink import FlakyHandler, SMTPSink
+
+    with SMTPSink(FlakyHandler(failures=2)) as sink, tempfile.TemporaryDirectory() as workdir:
+        os.environ.update({"sender_email": "check@example.com", "password": "check",
+                           "MAILER_HOST": sink.host, "MAILER_PORT": str(sink.port),
+                           "SMTP_STARTTLS": "false", "CAMPAIGN_DATA_DIR": workdir})
+        import mailer
+        from smtp_pool import SMTPConnectionPool
+
+        def send(item, smtp):
+            return mailer.send_email(item.receiver, item.subject, item.html_body, [], "Check", smtp=smtp,
+                                     plain_text="text", retry_transient=True)
+
+        pool = SMTPConnectionPool(sink.host, sink.port, username="check", password="check", size=2,
+                                  starttls=False)
+        engine = DeliveryEngine(pool, send, workers=2, max_retries=3, retry_backoff=0.01, max_backoff=0.05)
+        items = [OutboundEmail(i, f"user{i}@example.com", "Check", "<p>check</p>") for i in range(20)]
+        results = []
+        with pool:
+            engine.run(items, results.append)
+
+    expect(all(result.success for result in results) and len(results) == 20,
+           "every message reaches a relay that answers 451 twice per recipient")
+    expect(sink.handler.refused == 40 and engine.retries == 40,
+           f"each 451 caused exactly one retry ({sink.handler.refused} refused, {engine.retries} retries)")
+    expect(sink.handler.messages == 20, "no message was delivered twice")
+
+
+def check_per_domain_backoff():
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from smtp_sink import CountingHandler, FlakyHandler, SMTPSink
+    from mx_routing import CachedResolver, DirectDeliveryPool, StaticResolver
+
+    with SMTPSink(FlakyHandler(failures=1)) as flaky, SMTPSink(CountingHandler()) as healthy:
+        resolver = CachedResolver(StaticResolver({"throttled.test": f"{flaky.host}:{flaky.port}",
+                                                  "healthy.test": f"{healthy.host}:{healthy.port}"}))
+        pool = DirectDeliveryPool(resolver, per_domain=4, starttls=False)
+        with pool.session() as session:
+            for i in range(4):
+                try:
+                    session.sendmail("check@example.com", [f"user{i}@throttled.test"], b"Subject: check\r\n\r\ncheck\r\n")
+                except smtplib.SMTPRecipientsRefused:
+                    pass
+                session.sendmail("check@example.com", [f"user{i}@healthy.test"], b"Subject: check\r\n\r\ncheck\r\n")
+        pool.close()
+
+    throttled, healthy_slots = pool.slots("throttled.test"), pool.slots("healthy.test")
+    expect(throttled.limit == 1, f"4 refusals from one domain back its cap off from 4 to 1 (now {throttled.limit})")
+    expect(healthy_slots.limit == 4, f"the other domain keeps its full cap of 4 (now {healthy_slots.limit})")
+
+
+def check_sender_failure():
+    def send(item, smtp):
+        return True, "sent"
+
+    async def send_async(item, smtp):
+        return True, "sent"
+
+    def on_result(result):
+        raise OSError("log disk full")
+
+    for engine in (DeliveryEngine(NullPool(), send, workers=2, queue_size=2),
+                   AsyncDeliveryEngine(AsyncNullPool(), send_async, workers=2, queue_size=2)):
+        name = type(engine).__name__
+        items = [OutboundEmail(i, f"user{i}@example.com", "s", "h") for i in range(100)]
+        raised = []
+
+        def run():
+            try:
+                engine.run(items, on_result)
+            except OSError as e:
+                raised.append(e)
+
+        runner = threading.Thread(target=run, daemon=True)
+        runner.start()
+        runner.join(timeout=10)
+        expect(not runner.is_alive(), f"{name} stops when every sender dies while the queue is full")
+        expect(len(raised) == 1 and str(raised[0]) == "log disk full",
+               f"{name} re-raises the exception that killed its senders")
+
+
+def main():
+    check_rate_limiter()
+    check_adaptive_concurrency()
+    check_retry_heap()
+    check_flaky_relay()
+    check_per_domain_backoff()
+    check_sender_failure()
+    print("all throttling checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Local SMTP stand-in used by the benchmarks.
+
+Accepts AUTH with any credentials (over plain TCP), counts every message it
+receives and throws the content away, optionally after a delay standing in
+for relay latency. FlakyHandler additionally answers 4xx to simulate
+provider throttling. Requires ``pip install aiosmtpd``.
+"""
+import asyncio
+import logging
+import socket
+import threading
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+# aiosmtpd logs a deprecation warning about its own login_data on every AUTH
+logging.getLogger("mail.log").setLevel(logging.ERROR)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _accept_any(server, session, envelope, mechanism, auth_data):
+    return AuthResult(success=True)
+
+
+class CountingHandler:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.messages = 0
+        self.recipients = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        with self._lock:
+            self.messages += 1
+            self.recipients += len(envelope.rcpt_tos)
+            self.bytes += len(envelope.content or b"")
+        return "250 OK"
+
+
+class FlakyHandler(CountingHandler):
+    """Refuses each recipient's first ``failures`` RCPT attempts with a 4xx reply.
+
+    Stands in for a relay enforcing rate limits, to exercise retry/backoff.
+    """
+
+    def __init__(self, failures=1, reply="451 4.7.1 Rate limit exceeded, try again later"):
+        super().__init__()
+        self.failures = failures
+        self.reply = reply
+        self.refused = 0
+        self._attempts = {}
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        with self._lock:
+            attempts = self._attempts.get(address, 0)
+            self._attempts[address] = attempts + 1
+            if attempts < self.failures:
+                self.refused += 1
+                return self.reply
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+
+class SMTPSink:
+    """Context manager running a counting SMTP server on a free local port."""
+
+    def __init__(self, handler=None):
+        self.handler = handler or CountingHandler()
+        self.host = "127.0.0.1"
+        self.port = _free_port()
+        self._controller = Controller(
+            self.handler, hostname=self.host, port=self.port,
+            authenticator=_accept_any, auth_require_tls=False,
+        )
+
+    def __enter__(self):
+        self._controller.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._controller.stop()
@@ -0,0 +1,131 @@
+"""On-disk state for bulk campaigns, so an interrupted one can be resumed.
+
+Each campaign gets a directory holding the uploaded CSV, the form settings,
+the prepared attachment parts and the delivery journal. Once the campaign
+finishes, the CSV and attachments are removed and a ``done`` marker is left
+next to the journal; campaigns without the marker were interrupted.
+"""
+import json
+import os
+import re
+import shutil
+import time
+
+from journal import DeliveryJournal, JournalState
+from mime_parts import PreparedAttachments
+
+_CAMPAIGN_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class StoredCampaign:
+    """The files of one campaign."""
+
+    def __init__(self, directory, campaign_id):
+        self.id = campaign_id
+        self.directory = directory
+        self.csv_path = os.path.join(directory, "recipients.csv")
+        self.settings_path = os.path.join(directory, "campaign.json")
+        self.journal_path = os.path.join(directory, "journal.jsonl")
+        self.attachments_dir = os.path.join(directory, "attachments")
+        self.done_path = os.path.join(directory, "done")
+        self._settings = None
+
+    @property
+    def settings(self):
+        if self._settings is None:
+            with open(self.settings_path, encoding="utf-8") as f:
+                self._settings = json.load(f)
+        return self._settings
+
+    @property
+    def finished(self):
+        return os.path.exists(self.done_path)
+
+    def attachments(self):
+        """The PreparedAttachments saved with the campaign."""
+        parts = []
+        for i, filename in enumerate(self.settings.get("attachments", [])):
+            with open(os.path.join(self.attachments_dir, f"{i}.part"), "rb") as f:
+                parts.append((filename, f.read()))
+        return PreparedAttachments(parts)
+
+    def open_journal(self, **kwargs):
+        return DeliveryJournal(self.journal_path, **kwargs)
+
+    def journal_state(self):
+        return JournalState.load(self.journal_path)
+
+    def mark_done(self):
+        """Drop the recipient data and mark the campaign as finished."""
+        with open(self.done_path, "w", encoding="utf-8") as f:
+            f.write(str(time.time()))
+        try:
+            os.remove(self.csv_path)
+        except OSError:
+            pass
+        shutil.rmtree(self.attachments_dir, ignore_errors=True)
+
+
+class CampaignStore:
+    """Directory of StoredCampaigns, one subdirectory per campaign id."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def create(self, campaign_id, csv_path, settings, attachments, copy=False):
+        """Move the spooled CSV into a new campaign directory and save its settings.
+
+        With ``copy`` the CSV is copied instead, leaving the caller's file alone.
+        ``settings`` must be JSON-serializable; the attachment filenames and
+        ``created_at`` are added to it.
+        """
+        campaign = self._campaign(campaign_id)
+        os.makedirs(campaign.attachments_dir)
+        if copy:
+            shutil.copyfile(csv_path, campaign.csv_path)
+        else:
+            shutil.move(csv_path, campaign.csv_path)
+        for i, (_, part) in enumerate(attachments.parts):
+            with open(os.path.join(campaign.attachments_dir, f"{i}.part"), "wb") as f:
+                f.write(part)
+        settings = dict(settings,
+                        attachments=[filename for filename, _ in attachments.parts],
+                        created_at=time.time())
+        # Write-then-rename, so a crash never leaves half a settings file
+        tmp_path = campaign.settings_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(settings, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, campaign.settings_path)
+        return campaign
+
+    def get(self, campaign_id):
+        """The stored campaign with this id, or None."""
+        if not _CAMPAIGN_ID.fullmatch(campaign_id or ""):
+            return None
+        campaign = self._campaign(campaign_id)
+        if not os.path.exists(campaign.settings_path):
+            return None
+        return campaign
+
+    def unfinished(self):
+        """Campaigns that never completed, oldest first."""
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        campaigns = []
+        for name in names:
+            campaign = self.get(name)
+            if campaign is not None and not campaign.finished:
+                try:
+                    campaign.settings
+                except (OSError, ValueError):
+                    continue
+                campaigns.append(campaign)
+        campaigns.sort(key=lambda campaign: campaign.settings.get("created_at", 0))
+        return campaigns
+
+    def _campaign(self, campaign_id):
+        return StoredCampaign(os.path.join(self.root, campaign_id), campaign_id)
@@ -0,0 +1,129 @@
+"""Send a bulk campaign from the command line, without the web UI.
+
+Takes the same inputs as the web form, as files on disk, and uses the SMTP
+settings from .env::
+
+    python cli.py recipients.csv newsletter.md --subject "News for $name" \\
+        --attach report.pdf --workers 8 --rate-per-minute 600 --report results.csv
+    python cli.py recipients.csv newsletter.html --dry-run    # render to a zip of .eml files
+    python cli.py --resume 3f2a...                             # finish an interrupted campaign
+
+A real send is saved under CAMPAIGN_DATA_DIR like one from the web form, so
+if it is interrupted (Ctrl-C, a crash) --resume with the campaign id it
+printed sends to everyone not reached yet; the web UI lists it too.
+Progress goes to stderr. The exit status is 0 when every recipient was sent
+(or rendered), 1 when some failed or the campaign stopped with an error, and
+2 when it could not start.
+"""
+import argparse
+import os
+import sys
+
+from dry_run import OUTPUTS as DRY_RUN_OUTPUTS, ZIP
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("csv", nargs="?", help="Recipients CSV with an email column")
+    parser.add_argument("template", nargs="?", help="Email template (.html, .md or .txt)")
+    parser.add_argument("--resume", metavar="CAMPAIGN_ID",
+                        help="Continue an interrupted campaign with its saved settings")
+    parser.add_argument("--subject", default="",
+                        help="Subject line, may use $placeholders (default: taken from the template)")
+    parser.add_argument("--attach", action="append", default=[], metavar="FILE",
+                        help="Attach a file to every email (repeatable)")
+    parser.add_argument("--display-name", help="Sender display name (default: display_name from .env)")
+    parser.add_argument("--workers", type=int, help="Parallel SMTP senders (default: SEND_WORKERS)")
+    parser.add_argument("--rate-per-second", type=float, help="Send at most this many emails per second")
+    parser.add_argument("--rate-per-minute", type=float, help="Send at most this many emails per minute")
+    parser.add_argument("--rate-per-day", type=float, help="Send at most this many emails per day")
+    parser.add_argument("--preconvert", action="store_true", default=None,
+                        help="Convert the template once instead of every email (default: PRECONVERT_TEMPLATES)")
+    parser.add_argument("--no-preconvert", dest="preconvert", action="store_false")
+    parser.add_argument("--batch-identical", action="store_true", default=None,
+                        help="Send identical emails together (default: BATCH_IDENTICAL_EMAILS)")
+    parser.add_argument("--no-batch-identical", dest="batch_identical", action="store_false")
+    parser.add_argument("--dry-run", nargs="?", const=ZIP, choices=DRY_RUN_OUTPUTS,
+                        help="Render every email to .eml files instead of sending: zip (default), directory or none")
+    parser.add_argument("--profile", action="store_true", help="Run the campaign under cProfile")
+    parser.add_argument("--report", metavar="CSV", help="Write every recipient's outcome to this CSV file")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only print the summary")
+    args = parser.parse_args(argv)
+    if args.resume is None and (args.csv is None or args.template is None):
+        parser.error("the csv and template arguments are required (or --resume CAMPAIGN_ID)")
+    if args.resume is not None and (args.csv is not None or args.dry_run is not None):
+        parser.error("--resume takes the campaign's saved settings; leave out csv, template and --dry-run")
+    return args
+
+
+def print_progress(job, end):
+    total = f"/{job.total}" if job.total is not None else ""
+    print(f"{job.sent + job.failed + job.skipped}{total} rows: {job.sent} ok, {job.failed} failed, "
+          f"{job.skipped} skipped", end=end, file=sys.stderr, flush=True)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Imported after parsing, so --help and usage errors don't load the sending stack
+    import mailer
+
+    interactive = sys.stderr.isatty() and not args.quiet
+    try:
+        if args.resume is not None:
+            job = mailer.resume_campaign(args.resume)
+        else:
+            job = mailer.start_campaign(
+                args.csv, args.template, subject=args.subject, attachments=args.attach,
+                display_name=args.display_name, workers=args.workers,
+                rate_per_second=args.rate_per_second, rate_per_minute=args.rate_per_minute,
+                rate_per_day=args.rate_per_day, preconvert=args.preconvert,
+                batch_identical_emails=args.batch_identical, dry_run=args.dry_run is not None,
+                dry_run_output=args.dry_run or ZIP, profile=args.profile,
+            )
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    if args.dry_run is None and not args.quiet:
+        print(f"Campaign {job.id} (resume it with --resume {job.id} if interrupted)", file=sys.stderr)
+
+    try:
+        # Redraw one status line on a terminal; log a line now and then otherwise
+        while not job.wait(1.0 if interactive else 30.0):
+            if not args.quiet:
+                print_progress(job, "\r" if interactive else "\n")
+    except KeyboardInterrupt:
+        # Sender threads don't stop on their own, so leave without waiting for
+        # them, but first save what they did: the journal (for --resume), the
+        # dry run's archive and the report
+        if job.journal is not None:
+            job.journal.flush()
+        if job.dry_run is not None:
+            job.dry_run.close()
+        job.report.flush()
+        print(f"\nInterrupted: {job.sent} sent, {job.failed} failed so far. Report: {job.report.path}",
+              file=sys.stderr)
+        if job.journal is not None:
+            print(f"Send to the rest with: python cli.py --resume {job.id}", file=sys.stderr)
+        os._exit(130)
+    if interactive:
+        print_progress(job, "\n")
+
+    if args.report:
+        with open(args.report, "w", newline="", encoding="utf-8") as f:
+            for chunk in job.report.iter_csv():
+                f.write(chunk)
+
+    label = "rendered" if job.dry_run else "sent"
+    print(f"{job.sent} {label}, {job.failed} failed, {job.skipped} skipped "
+          f"in {job.finished_at - job.started_at:.1f}s. Report: {args.report or job.report.path}")
+    if job.dry_run is not None and job.dry_run.path:
+        print(f"Dry run: {job.dry_run.messages} message(s) saved to {job.dry_run.path}; nothing was sent.")
+    if job.profile_path:
+        print(f"Profile: {job.profile_path}")
+    if job.error:
+        print(f"Error: The campaign stopped unexpectedly: {job.error}", file=sys.stderr)
+    return 1 if job.failed or job.error else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""Concurrent delivery engine for bulk campaigns.
+
+Rendering stays on the calling thread while N sender threads do the network
+I/O. The two sides are joined by a bounded queue, so a slow relay makes the
+renderer wait instead of piling rendered messages up in memory.
+
+Transient failures (4xx replies, dropped connections) are not final: the
+message is re-queued with exponential backoff, and an optional rate limiter
+and adaptive concurrency cap slow the senders down when the relay pushes back.
+
+Recipients whose rendered messages are identical can be grouped into
+OutboundBatch items by batch_identical() and sent as one SMTP transaction.
+"""
+import heapq
+import itertools
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import nullcontext
+
+# A fully rendered message waiting for a sender. row_number is the CSV row
+# (header = row 1) or None for manual sends; plain_body is None when the plain
+# text alternative should be generated from html_body at send time.
+OutboundEmail = namedtuple("OutboundEmail", "row_number receiver subject html_body plain_body",
+                           defaults=(None,))
+
+# The outcome for one recipient, in the same (success, message) shape that
+# send_email returns.
+DeliveryResult = namedtuple("DeliveryResult", "row_number receiver success message")
+
+# One rendered message for several recipients, delivered in a single SMTP
+# transaction with one RCPT TO per recipient. recipients is a tuple of
+# (row_number, receiver) pairs.
+OutboundBatch = namedtuple("OutboundBatch", "recipients subject html_body plain_body")
+
+_STOP = object()
+
+
+class TransientDeliveryError(Exception):
+    """Raised by a send function for failures that should be retried later.
+
+    A batch send that went through for some recipients passes their outcomes
+    as ``settled`` and the remaining recipients as ``retry`` (an
+    OutboundBatch), so only those are sent again.
+    """
+
+    def __init__(self, message, smtp_code=None, settled=(), retry=None):
+        super().__init__(message)
+        self.smtp_code = smtp_code
+        self.settled = list(settled)
+        self.retry = retry
+
+
+def recipients_of(item):
+    """(row_number, receiver) pairs an OutboundEmail or OutboundBatch is addressed to."""
+    if isinstance(item, OutboundBatch):
+        return list(item.recipients)
+    return [(item.row_number, item.receiver)]
+
+
+def batch_identical(items, batch_size, max_open=64, group_key=None):
+    """Group OutboundEmails with identical content into OutboundBatches.
+
+    Messages with the same subject and bodies (and the same ``group_key(item)``,
+    when given) are collected until ``batch_size`` recipients share them. At most ``max_open`` distinct
+    contents wait for company at a time; beyond that the least recently
+    extended group is sent as it is, so personalized campaigns only lag by a
+    few messages. Groups of one stay plain OutboundEmails and DeliveryResults
+    pass straight through.
+    """
+    pending = OrderedDict()
+
+    def flush(group):
+        if len(group) == 1:
+            return group[0]
+        first = group[0]
+        return OutboundBatch(tuple((item.row_number, item.receiver) for item in group),
+                             first.subject, first.html_body, first.plain_body)
+
+    for item in items:
+        if not isinstance(item, OutboundEmail):
+            yield item
+            continue
+        key = (item.subject, item.html_body, item.plain_body)
+        if group_key is not None:
+            key += (group_key(item),)
+        group = pending.get(key)
+        if group is None:
+            group = pending[key] = []
+        else:
+            pending.move_to_end(key)
+        group.append(item)
+        if len(group) >= batch_size:
+            del pending[key]
+            yield flush(group)
+        elif len(pending) > max_open:
+            _, oldest = pending.popitem(last=False)
+            yield flush(oldest)
+    for group in pending.values():
+        yield flush(group)
+
+
+class DeliveryEngine:
+    """Send rendered messages over ``workers`` parallel SMTP sessions.
+
+    ``send(outbound, smtp)`` does the actual delivery and returns
+    ``(success, message)``, or a list of DeliveryResults (one per recipient)
+    for an OutboundBatch; ``smtp`` is the pooled session owned by the
+    sender thread that picked the message up. It may raise
+    TransientDeliveryError, in which case the message is retried up to
+    ``max_retries`` times, waiting ``retry_backoff`` seconds before the first
+    retry and doubling from there (with jitter, capped at ``max_backoff``).
+
+    ``rate_limiter`` (a throttle.RateLimiter) is acquired for every
+    recipient before a send and ``concurrency`` (a throttle.AdaptiveConcurrency) caps how many
+    senders may be mid-send at once, backing off on transient failures.
+    ``thread_context``, if given, is called for a context manager that each
+    sender thread runs inside (e.g. profiling.CampaignProfiler.thread).
+    """
+
+    def __init__(self, pool, send, workers=1, queue_size=None, rate_limiter=None,
+                 concurrency=None, max_retries=0, retry_backoff=10.0, max_backoff=300.0,
+                 clock=time.monotonic, sleep=time.sleep, thread_context=None):
+        self.pool = pool
+        self.send = send
+        self.workers = max(1, int(workers))
+        self.queue_size = queue_size or self.workers * 4
+        self.rate_limiter = rate_limiter
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.sleep = sleep
+        self.thread_context = thread_context or nullcontext
+        self.retries = 0
+
+        self._lock = threading.Lock()
+        self._outstanding = 0 # Queued or being sent
+        self._retry_heap = [] # (due, seq, item, attempt)
+        self._seq = itertools.count()
+        self._failure = None # First exception that stopped a sender thread
+
+    def run(self, items, on_result):
+        """Deliver everything ``items`` yields, calling ``on_result`` per recipient.
+
+        ``items`` is consumed lazily on this thread and may yield
+        OutboundEmail or OutboundBatch (to be sent) or DeliveryResult
+        (already decided, e.g. a render failure). ``on_result`` is called with one DeliveryResult at
+        a time, never concurrently, in completion order.
+
+        If a sender thread dies (``on_result`` or the pool raised), the
+        remaining work is dropped and its exception is re-raised here.
+        """
+        work = queue.Queue(maxsize=self.queue_size)
+        report_lock = threading.Lock()
+
+        def report(result):
+            with report_lock:
+                on_result(result)
+
+        senders = [
+            threading.Thread(target=self._sender, args=(work, report),
+                             name=f"smtp-sender-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for sender in senders:
+            sender.start()
+        try:
+            for item in items:
+                if isinstance(item, DeliveryResult):
+                    report(item)
+                    continue
+                self._feed_due_retries(work)
+                self._enqueue(work, item, 0)
+
+            # Wait for in-flight sends, feeding retries as they come due
+            while True:
+                with self._lock:
+                    if not self._outstanding and not self._retry_heap:
+                        break
+                    next_due = self._retry_heap[0][0] if self._retry_heap else None
+                self._raise_failure()
+                if not self._feed_due_retries(work):
+                    # Poll often enough to notice the last in-flight send finishing
+                    delay = 0.05 if next_due is None else next_due - self.clock()
+                    self.sleep(min(max(delay, 0.01), 0.05))
+        finally:
+            if self._failure is not None:
+                # Nobody may be left to take the queued messages; drop them
+                self._discard_queued(work)
+            for sender in senders:
+                if sender.is_alive():
+                    work.put(_STOP)
+            for sender in senders:
+                sender.join()
+        self._raise_failure()
+
+    def _raise_failure(self):
+        with self._lock:
+            failure = self._failure
+        if failure is not None:
+            raise failure
+
+    def _discard_queued(self, work):
+        while True:
+            try:
+                work.get_nowait()
+            except queue.Empty:
+                return
+
+    def _enqueue(self, work, item, attempt):
+        with self._lock:
+            self._outstanding += 1
+        while True:
+            # A full queue with dead senders would block forever; keep checking
+            self._raise_failure()
+            try:
+                work.put((item, attempt), timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _feed_due_retries(self, work):
+        """Move retries whose backoff has elapsed onto the work queue."""
+        fed = False
+        while True:
+            with self._lock:
+                if not self._retry_heap or self._retry_heap[0][0] > self.clock():
+                    return fed
+                _, _, item, attempt = heapq.heappop(self._retry_heap)
+            self._enqueue(work, item, attempt)
+            fed = True
+
+    def _schedule_retry(self, item, attempt):
+        delay = min(self.max_backoff, self.retry_backoff * (2 ** (attempt - 1)))
+        delay *= random.uniform(0.8, 1.2) # Jitter so retries don't arrive in lockstep
+        with self._lock:
+            heapq.heappush(self._retry_heap, (self.clock() + delay, next(self._seq), item, attempt))
+            self.retries += 1
+
+    def _sender(self, work, report):
+        try:
+            with self.thread_context(), self.pool.session() as session:
+                while True:
+                    entry = work.get()
+                    if entry is _STOP:
+                        return
+                    item, attempt = entry
+                    try:
+                        for result in self._attempt(item, attempt, session):
+                            report(result)
+                    finally:
+                        with self._lock:
+                            self._outstanding -= 1
+        except BaseException as e:
+            # run() re-raises it; this thread stops taking work
+            with self._lock:
+                if self._failure is None:
+                    self._failure = e
+
+    def _attempt(self, item, attempt, session):
+        """Try one send; returns the DeliveryResults decided by it.
+
+        Recipients that were re-queued for a retry get no result yet.
+        """
+        if self.concurrency is not None:
+            self.concurrency.acquire()
+        try:
+            if self.rate_limiter:
+                self.rate_limiter.acquire(len(recipients_of(item)))
+            outcome = self.send(item, session)
+        except Exception as e:
+            return self._send_failed(item, attempt, e)
+        finally:
+            if self.concurrency is not None:
+                self.concurrency.release()
+        return self._sent(item, outcome)
+
+    def _sent(self, item, outcome):
+        """DeliveryResults for what ``send`` returned."""
+        if isinstance(item, OutboundBatch):
+            results = list(outcome)
+        else:
+            success, message = outcome
+            results = [DeliveryResult(item.row_number, item.receiver, success, message)]
+        if self.concurrency is not None and any(result.success for result in results):
+            self.concurrency.succeeded()
+        return results
+
+    def _send_failed(self, item, attempt, exc):
+        """Retry a transient failure or turn ``exc`` into failed DeliveryResults."""
+        if not isinstance(exc, TransientDeliveryError):
+            return [DeliveryResult(row, receiver, False,
+                                   f"An unexpected error occurred sending to {receiver}: {exc.__class__.__name__} - {exc}")
+                    for row, receiver in recipients_of(item)]
+        if self.concurrency is not None:
+            self.concurrency.backoff()
+        retry = exc.retry if exc.retry is not None else item
+        if attempt < self.max_retries:
+            self._schedule_retry(retry, attempt + 1)
+            return exc.settled
+        message = f"{exc} (gave up after {attempt + 1} attempts)"
+        return exc.settled + [DeliveryResult(row, receiver, False, message)
+                              for row, receiver in recipients_of(retry)]
@@ -0,0 +1,96 @@
+"""Dry runs: the whole render pipeline, with SMTP replaced by .eml files.
+
+EmlWriter stands in for the SMTP connection pool, so a campaign goes
+through the same CSV parsing, substitution, conversion and MIME assembly
+as a real send. The finished messages are written to a zip archive or a
+directory (or just counted), and the first few are kept to preview.
+"""
+import os
+import re
+import threading
+import zipfile
+from contextlib import contextmanager
+from email import policy
+from email.parser import BytesParser
+
+ZIP = "zip"
+DIRECTORY = "directory"
+DISCARD = "none"
+OUTPUTS = (ZIP, DIRECTORY, DISCARD)
+
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^A-Za-z0-9@._+-]")
+
+
+def eml_filename(sequence, recipients):
+    """``000042-alice@example.com.eml``; batches add ``+N`` for the other recipients."""
+    name = _UNSAFE_FILENAME_CHARS.sub("_", recipients[0])[:100] if recipients else "message"
+    if len(recipients) > 1:
+        name += f"+{len(recipients) - 1}"
+    return f"{sequence:06d}-{name}.eml"
+
+
+class EmlWriter:
+    """Collects a dry run's messages instead of sending them.
+
+    ``output`` is ZIP (``path`` is the archive), DIRECTORY (``path`` is the
+    folder) or DISCARD. The first ``sample_size`` messages are kept in
+    memory for preview. Usable as a delivery engine's pool: ``session()``
+    yields the writer itself.
+    """
+
+    def __init__(self, path=None, output=ZIP, sample_size=3):
+        self.output = output if path else DISCARD
+        self.path = path
+        self.sample_size = sample_size
+        self.samples = []
+        self.messages = 0
+        self.bytes = 0
+        self._zip = None
+        self._lock = threading.Lock()
+        if self.output == ZIP:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+        elif self.output == DIRECTORY:
+            os.makedirs(path, exist_ok=True)
+
+    @contextmanager
+    def session(self):
+        yield self
+
+    def write(self, recipients, message):
+        """Store one rendered message (bytes) addressed to ``recipients``."""
+        recipients = list(recipients)
+        with self._lock:
+            self.messages += 1
+            self.bytes += len(message)
+            if len(self.samples) < self.sample_size:
+                self.samples.append((recipients, message))
+            name = eml_filename(self.messages, recipients)
+            if self._zip is not None:
+                self._zip.writestr(name, message)
+            elif self.output == DIRECTORY:
+                with open(os.path.join(self.path, name), "wb") as f:
+                    f.write(message)
+
+    def close(self):
+        with self._lock:
+            if self._zip is not None:
+                self._zip.close()
+                self._zip = None
+
+
+def describe_message(recipients, message):
+    """The parts of a rendered message a preview shows."""
+    msg = BytesParser(policy=policy.default).parsebytes(message)
+    html = msg.get_body(preferencelist=("html",))
+    plain = msg.get_body(preferencelist=("plain",))
+    return {
+        "recipients": recipients,
+        "from": msg["From"],
+        "to": msg["To"],
+        "subject": msg["Subject"],
+        "html": html.get_content() if html is not None else None,
+        "text": plain.get_content() if plain is not None else "",
+        "attachments": [part.get_filename() for part in msg.iter_attachments()],
+        "size": len(message),
+    }
@@ -0,0 +1,176 @@
+"""In-process background jobs for bulk campaigns.
+
+The POST handler validates the form, submits the campaign here and returns at
+once; the job runs on a small thread pool and its counters can be polled
+while it is running. Jobs live in memory, so the app must run as a single
+process for the status page to find them. Their per-recipient logs are
+streamed to report files (see reports.py) rather than kept in memory.
+"""
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import reports
+from reports import DeliveryReport
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+
+DEFAULT_REPORT_DIR = os.path.join(tempfile.gettempdir(), "campaign-reports")
+
+
+class CampaignJob:
+    """Progress of one campaign: counters plus the per-recipient log (a DeliveryReport)."""
+
+    def __init__(self, job_id, total=None, report_path=None):
+        self.id = job_id
+        self.state = QUEUED
+        # Rows to process; None until a streaming source has counted them
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # metrics.PipelineMetrics for this run (set by the campaign function)
+        self.metrics = None
+        # Path of the profiler report, when the campaign was profiled
+        self.profile_path = None
+        # dry_run.EmlWriter holding the rendered messages, when this was a dry run
+        self.dry_run = None
+        # journal.DeliveryJournal of a stored campaign, while it runs
+        self.journal = None
+        self.report = DeliveryReport(report_path or os.path.join(DEFAULT_REPORT_DIR, f"{job_id}.jsonl"))
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    @property
+    def finished(self):
+        return self.state in (DONE, ERROR)
+
+    def wait(self, timeout=None):
+        """Block until the job has finished (or ``timeout`` seconds pass); returns ``finished``."""
+        self._done.wait(timeout)
+        return self.finished
+
+    def record(self, success, row_number, line, receiver=None, message=None):
+        with self._lock:
+            if success:
+                self.sent += 1
+            else:
+                self.failed += 1
+        self.report.add(reports.SENT if success else reports.FAILED, line, row_number, receiver, message)
+        if self.metrics is not None:
+            self.metrics.count("emails", result="sent" if success else "failed")
+
+    def carry_over(self, sent, line):
+        """Count recipients an earlier, interrupted run already delivered."""
+        with self._lock:
+            self.sent += sent
+        self.report.add(reports.NOTE, line)
+
+    def restore(self, row_number, line, receiver=None):
+        """Log a delivery an interrupted run journaled but may not have logged.
+
+        Counted by ``carry_over``; rows the report already shows as sent are left alone.
+        """
+        if not self.report.logged_before(row_number, reports.SENT):
+            self.report.add(reports.SENT, line, row_number, receiver)
+
+    def skip(self, row_number, line, receiver=None):
+        with self._lock:
+            self.skipped += 1
+        # A resumed run skips the same rows again; log them once
+        if not self.report.logged_before(row_number, reports.SKIPPED):
+            self.report.add(reports.SKIPPED, line, row_number, receiver)
+        if self.metrics is not None:
+            self.metrics.count("emails", result="skipped")
+
+    def snapshot(self, log_offset=0):
+        """Counters plus the log lines from ``log_offset`` on that are still in memory."""
+        log_offset, log = self.report.recent(log_offset)
+        with self._lock:
+            return {
+                "id": self.id,
+                "state": self.state,
+                "total": self.total,
+                "sent": self.sent,
+                "failed": self.failed,
+                "skipped": self.skipped,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "log_offset": log_offset,
+                "log": log,
+                "log_total": log_offset + len(log),
+            }
+
+
+class JobManager:
+    """Runs campaign functions in the background and keeps recent jobs around."""
+
+    def __init__(self, max_workers=2, keep_finished=50, report_dir=DEFAULT_REPORT_DIR):
+        self.keep_finished = keep_finished
+        self.report_dir = report_dir
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="campaign")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, total=None, job_id=None, **kwargs):
+        """Queue ``func(job, *args, **kwargs)`` and return its CampaignJob.
+
+        A ``job_id`` replaces a finished job with that id (e.g. when a stored
+        campaign is resumed); ValueError is raised if that job is still running.
+        """
+        job_id = job_id or uuid.uuid4().hex
+        with self._lock:
+            existing = self._jobs.get(job_id)
+            if existing is not None and not existing.finished:
+                raise ValueError(f"Job {job_id} is already running")
+            if existing is not None:
+                existing.report.close()
+            # Reusing the id appends to the earlier run's report
+            job = CampaignJob(job_id, total=total,
+                              report_path=os.path.join(self.report_dir, f"{job_id}.jsonl"))
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, func, args, kwargs):
+        job.state = RUNNING
+        job.started_at = time.time()
+        try:
+            func(job, *args, **kwargs)
+        except Exception as e:
+            print(f"Error: Campaign job {job.id} crashed: {e.__class__.__name__} - {e}")
+            job.error = f"{e.__class__.__name__}: {e}"
+            job.finished_at = time.time()
+            job.state = ERROR
+        else:
+            job.finished_at = time.time()
+            job.state = DONE
+        finally:
+            job.report.close() # Written to by nothing else now; pages read it separately
+            job._done.set()
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.finished]
+        if len(finished) <= self.keep_finished:
+            return
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[:len(finished) - self.keep_finished]:
+            del self._jobs[job.id]
+            job.report.discard()
@@ -0,0 +1,110 @@
+"""Durable per-recipient delivery journal for resumable campaigns.
+
+Every delivery outcome is appended to a JSON-lines file. Entries are
+buffered and written (and fsynced) in groups, so the journal costs one disk
+flush per ``flush_every`` sends or ``flush_interval`` seconds rather than
+one per recipient. If the process dies, at most the last unflushed group is
+lost; those recipients may be mailed again on resume.
+"""
+import json
+import os
+import threading
+import time
+
+from validation import address_key, normalize_address
+
+SENT = "sent"
+FAILED = "failed"
+
+
+class DeliveryJournal:
+    """Append-only, group-committed log of delivery outcomes."""
+
+    def __init__(self, path, flush_every=200, flush_interval=1.0, fsync=True, clock=time.monotonic):
+        self.path = path
+        self.flush_every = max(1, int(flush_every))
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.clock = clock
+        self.flushes = 0
+        self._buffer = []
+        self._file = open(path, "a", encoding="utf-8")
+        self._last_flush = clock()
+        self._lock = threading.Lock()
+
+    def record(self, row_number, receiver, status, message=None):
+        entry = {"row": row_number, "email": receiver, "status": status, "at": round(time.time(), 3)}
+        if message:
+            entry["message"] = message
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._buffer.append(line)
+            if (len(self._buffer) >= self.flush_every
+                    or self.clock() - self._last_flush >= self.flush_interval):
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._last_flush = self.clock()
+        if not self._buffer:
+            return
+        self._file.write("".join(self._buffer))
+        self._buffer.clear()
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.flushes += 1
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._flush_locked()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_journal(path):
+    """Yield the entries of a journal file, oldest first.
+
+    A torn final line (the process died mid-write) is ignored.
+    """
+    try:
+        f = open(path, encoding="utf-8")
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+class JournalState:
+    """What a journal says has already been delivered."""
+
+    def __init__(self, entries=()):
+        # Rows, and address keys as duplicate detection computes them, recorded as sent
+        self.delivered_rows = set()
+        self.delivered_addresses = set()
+        for entry in entries:
+            if entry.get("status") != SENT:
+                continue
+            self.delivered_rows.add(entry.get("row"))
+            self.delivered_addresses.add(address_key(normalize_address(entry.get("email"))))
+
+    @classmethod
+    def load(cls, path):
+        return cls(read_journal(path))
+
+    def address_delivered(self, receiver):
+        return address_key(normalize_address(receiver)) in self.delivered_addresses
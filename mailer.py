@@ -0,0 +1,1027 @@
+"""Bulk sending without the web UI: settings, CSV streaming, rendering and delivery.
+
+app.py puts a Flask front end on this module and cli.py a command line one;
+scripts can call start_campaign/send_campaign directly. Nothing here imports
+Flask, and Markdown and html2text are imported the first time a campaign
+needs them, so headless runs start quickly.
+"""
+import os
+import re
+import csv
+import io
+import codecs
+import itertools
+import threading
+import uuid
+from functools import partial
+import smtplib
+from dotenv import load_dotenv
+from smtp_pool import SMTPConnectionPool
+from async_smtp import AsyncSMTPPool
+from delivery import (DeliveryEngine, DeliveryResult, OutboundBatch, OutboundEmail,
+                      TransientDeliveryError, batch_identical, recipients_of)
+from dry_run import DISCARD, ZIP, EmlWriter
+from async_delivery import AsyncDeliveryEngine
+from mx_routing import CachedResolver, DNSResolver, DirectDeliveryPool, StaticResolver, interleave_domains, recipient_domain
+from campaigns import CampaignStore
+from jobs import JobManager
+from journal import FAILED, SENT
+from metrics import PipelineMetrics, timed, timed_iter
+from profiling import CampaignProfiler
+from mime_parts import PreparedAttachments, build_message, prepare_attachments, read_attachments
+from templating import compile_template
+from rendering import BodyConverter
+from validation import DUPLICATE, INVALID, SUPPRESSED, RecipientValidator, load_suppression_list
+from throttle import AdaptiveConcurrency, RateLimiter, is_transient_smtp_error, smtp_error_code
+
+# Load environment variables from .env
+load_dotenv()
+DEFAULT_DISPLAY_NAME = os.getenv('display_name', 'Default Sender Name')
+SENDER_EMAIL = os.getenv('sender_email')
+PASSWORD = os.getenv('password')
+
+# Load SMTP configuration
+MAILER_HOST = os.getenv('MAILER_HOST', "smtp.mailersend.net")
+MAILER_PORT = int(os.getenv('MAILER_PORT', "587"))
+# STARTTLS: "auto" upgrades unless the port is 465 (implicit TLS); "false" for a
+# plain-text relay on a trusted network (e.g. a local sink), "true" to insist
+SMTP_STARTTLS = {"true": True, "false": False}.get(os.getenv('SMTP_STARTTLS', "auto").strip().lower())
+
+# SMTP session reuse: recycle a connection after this many messages,
+# and NOOP-check it before reuse once it has been idle this many seconds
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv('SMTP_MAX_MESSAGES_PER_CONNECTION', "100"))
+SMTP_KEEPALIVE_SECONDS = float(os.getenv('SMTP_KEEPALIVE_SECONDS', "30"))
+
+# Parallel SMTP senders for bulk sends (the form can pick up to MAX_SEND_WORKERS)
+SEND_WORKERS = int(os.getenv('SEND_WORKERS', "4"))
+MAX_SEND_WORKERS = int(os.getenv('MAX_SEND_WORKERS', "16"))
+
+# "threads": one blocking smtplib session per sender thread. "asyncio": all senders
+# share one event loop, so hundreds of sessions are cheap (raise MAX_SEND_WORKERS to match)
+SMTP_TRANSPORT = os.getenv('SMTP_TRANSPORT', "threads").strip().lower()
+SMTP_TIMEOUT_SECONDS = float(os.getenv('SMTP_TIMEOUT_SECONDS', "30"))
+
+# "relay" sends everything through MAILER_HOST. "direct" delivers to each recipient
+# domain's MX hosts (port DIRECT_MX_PORT, STARTTLS when offered, no AUTH), with at most
+# DIRECT_MAX_CONNECTIONS_PER_DOMAIN transactions per domain and
+# DIRECT_MAX_CONNECTIONS_PER_HOST connections per MX host. MX answers are cached for
+# their TTL, capped at MX_CACHE_SECONDS. DIRECT_MX_OVERRIDES routes domains to fixed
+# hosts ("example.com=host:port|backup:port,*=host:port"), e.g. local test servers.
+DELIVERY_MODE = os.getenv('DELIVERY_MODE', "relay").strip().lower()
+DIRECT_MX_PORT = int(os.getenv('DIRECT_MX_PORT', "25"))
+DIRECT_MAX_CONNECTIONS_PER_DOMAIN = int(os.getenv('DIRECT_MAX_CONNECTIONS_PER_DOMAIN', "2"))
+DIRECT_MAX_CONNECTIONS_PER_HOST = int(os.getenv('DIRECT_MAX_CONNECTIONS_PER_HOST', "4"))
+DIRECT_HELO_HOSTNAME = os.getenv('DIRECT_HELO_HOSTNAME') or None
+DIRECT_MX_OVERRIDES = os.getenv('DIRECT_MX_OVERRIDES', "")
+MX_CACHE_SECONDS = float(os.getenv('MX_CACHE_SECONDS', "300"))
+
+# Provider quotas (unset = unlimited), shared by every campaign sending through this account
+SEND_RATE_PER_SECOND = float(os.getenv('SEND_RATE_PER_SECOND') or 0)
+SEND_RATE_PER_MINUTE = float(os.getenv('SEND_RATE_PER_MINUTE') or 0)
+SEND_RATE_PER_DAY = float(os.getenv('SEND_RATE_PER_DAY') or 0)
+
+# Temporary failures (4xx replies, dropped connections) are retried with exponential backoff
+SMTP_MAX_RETRIES = int(os.getenv('SMTP_MAX_RETRIES', "5"))
+SMTP_RETRY_BACKOFF_SECONDS = float(os.getenv('SMTP_RETRY_BACKOFF_SECONDS', "10"))
+SMTP_MAX_BACKOFF_SECONDS = float(os.getenv('SMTP_MAX_BACKOFF_SECONDS', "300"))
+
+# Campaigns run as background jobs; this many may send at the same time
+MAX_CONCURRENT_CAMPAIGNS = int(os.getenv('MAX_CONCURRENT_CAMPAIGNS', "2"))
+
+# Body conversion: how many converted bodies to remember per campaign, and whether
+# the form defaults to converting the template once with placeholders protected
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', "128"))
+PRECONVERT_TEMPLATES = os.getenv('PRECONVERT_TEMPLATES', "false").lower() in ("1", "true", "yes", "on")
+
+# Batching: recipients of identical emails share one SMTP transaction (one RCPT TO
+# each, addressed like Bcc). The form defaults to BATCH_IDENTICAL_EMAILS.
+BATCH_IDENTICAL_EMAILS = os.getenv('BATCH_IDENTICAL_EMAILS', "false").lower() in ("1", "true", "yes", "on")
+SMTP_MAX_RECIPIENTS_PER_MESSAGE = int(os.getenv('SMTP_MAX_RECIPIENTS_PER_MESSAGE', "50"))
+
+# Recipient checks before sending: duplicate addresses are sent once (tracked with a
+# Bloom filter above DEDUP_BLOOM_ABOVE_ROWS rows, 0 = never), and addresses listed in
+# SUPPRESSION_LIST (one per line, or @domain) are never sent to
+DEDUPLICATE_RECIPIENTS = os.getenv('DEDUPLICATE_RECIPIENTS', "true").lower() in ("1", "true", "yes", "on")
+DEDUP_BLOOM_ABOVE_ROWS = int(os.getenv('DEDUP_BLOOM_ABOVE_ROWS', "2000000"))
+DEDUP_BLOOM_ERROR_RATE = float(os.getenv('DEDUP_BLOOM_ERROR_RATE', "0.000001"))
+SUPPRESSION_LIST = os.getenv('SUPPRESSION_LIST') or None
+
+# Bulk campaigns are saved here (CSV, settings, delivery journal) so an interrupted
+# one can be resumed; journal writes are flushed every N sends or S seconds
+CAMPAIGN_DATA_DIR = os.getenv('CAMPAIGN_DATA_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), "campaigns")
+JOURNAL_FLUSH_EVERY = int(os.getenv('JOURNAL_FLUSH_EVERY', "200"))
+JOURNAL_FLUSH_SECONDS = float(os.getenv('JOURNAL_FLUSH_SECONDS', "1"))
+
+# Per-recipient results are streamed to a report file per campaign (downloadable as CSV)
+REPORT_DIR = os.getenv('REPORT_DIR') or os.path.join(CAMPAIGN_DATA_DIR, "reports")
+
+# Dry runs render every email without sending; their .eml files are written under
+# DRY_RUN_DIR and the first DRY_RUN_SAMPLE_SIZE are previewed on the results page
+DRY_RUN_DIR = os.getenv('DRY_RUN_DIR') or os.path.join(CAMPAIGN_DATA_DIR, "dry-runs")
+DRY_RUN_SAMPLE_SIZE = int(os.getenv('DRY_RUN_SAMPLE_SIZE', "3"))
+
+# Profiling: reports of campaigns run under cProfile go to PROFILE_DIR
+PROFILE_DIR = os.getenv('PROFILE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+
+# Basic validation for required env vars
+def sender_configured():
+    # Direct delivery doesn't log in anywhere, so it only needs the sender address
+    return bool(SENDER_EMAIL) and (bool(PASSWORD) or DELIVERY_MODE == "direct")
+
+
+# Campaigns run as background jobs, whether started from the web form or headless,
+# and real sends are saved in the campaign store so they can be resumed
+campaign_jobs = JobManager(max_workers=MAX_CONCURRENT_CAMPAIGNS, report_dir=REPORT_DIR)
+campaign_store = CampaignStore(CAMPAIGN_DATA_DIR)
+# Process-wide stage timings and counters, served on /metrics
+pipeline_metrics = PipelineMetrics()
+# MX resolver for direct delivery, shared so answers are cached across campaigns
+mx_resolver = None
+send_rate_limiter = RateLimiter(per_second=SEND_RATE_PER_SECOND,
+                                per_minute=SEND_RATE_PER_MINUTE,
+                                per_day=SEND_RATE_PER_DAY)
+
+# Characters read from the start of a CSV to sniff its dialect
+CSV_SNIFF_CHARS = 2048
+
+def process_csv_data(csv_source):
+    """Parse CSV text into ``(rows, headers)`` without materializing it.
+
+    ``csv_source`` is a string or a text stream (e.g. a file opened with
+    ``newline=''``). ``rows`` is a lazy iterator of dicts keyed by the
+    stripped, lowercased headers, consumed straight from the stream, so
+    memory use does not grow with the number of rows. Returns
+    ``(None, None)`` when the CSV cannot be parsed.
+    """
+    try:
+        csv_io = io.StringIO(csv_source) if isinstance(csv_source, str) else csv_source
+
+        # Sniff the dialect from a prefix only. Complete its last line so the
+        # prefix can be chained back in front of the rest of the stream.
+        sample = csv_io.read(CSV_SNIFF_CHARS)
+        if sample and not sample.endswith('\n'):
+            sample += csv_io.readline()
+        # Handle potential BOM (Byte Order Mark) which can interfere with sniffing/headers
+        if sample.startswith('\ufeff'):
+             sample = sample.lstrip('\ufeff')
+
+        try:
+            dialect = csv.Sniffer().sniff(sample)
+        except csv.Error:
+             # If sniffing fails, assume standard comma-separated CSV
+             print("Warning: CSV Sniffing failed, assuming comma delimiter.")
+             dialect = csv.excel # Default fallback
+
+        lines = itertools.chain(io.StringIO(sample), csv_io)
+        fieldnames = next(csv.reader(lines, dialect=dialect), None)
+        if not fieldnames:
+            print("Error processing CSV: No header row found.")
+            return None, None
+        fieldnames = [h.strip().lower() for h in fieldnames] # Ensure lowercase/strip
+        headers = fieldnames
+        # Check for empty headers which can cause issues
+        if '' in headers:
+             print("Warning: Empty column header(s) found in CSV.")
+             # Option: filter them out or raise error depending on strictness
+             headers = [h for h in headers if h]
+
+        # The header line has been consumed from `lines`; the rest are data rows
+        rows = csv.DictReader(lines, fieldnames=fieldnames, dialect=dialect)
+        return rows, headers
+    except Exception as e:
+        print(f"Error processing CSV: {e}")
+        return None, None
+
+# Bytes of an upload checked by detect_csv_encoding (and sampled by estimate_csv_rows)
+CSV_SNIFF_BYTES = 64 * 1024
+
+def _latin1_fallback(error):
+    # Decode just the bytes that aren't UTF-8 as Latin-1 and carry on
+    return error.object[error.start:error.end].decode("latin-1"), error.end
+
+codecs.register_error("csv_latin1_fallback", _latin1_fallback)
+
+def detect_csv_encoding(csv_path):
+    """'utf-8-sig' if the start of the file is valid UTF-8, else 'latin-1'.
+
+    Only the first CSV_SNIFF_BYTES are checked, so a large upload is not
+    decoded an extra time before the campaign starts; open_csv decodes any
+    later byte that isn't UTF-8 as Latin-1.
+    """
+    with open(csv_path, "rb") as f:
+        sample = f.read(CSV_SNIFF_BYTES)
+    try:
+        # Not final: a character cut off at the end of the sample is fine
+        codecs.getincrementaldecoder("utf-8")().decode(sample)
+    except UnicodeDecodeError:
+        return "latin-1"
+    return "utf-8-sig" # Handles UTF-8 with BOM
+
+def open_csv(csv_path, encoding):
+    """Open a saved CSV as text in the encoding detect_csv_encoding picked."""
+    return open(csv_path, newline='', encoding=encoding, errors="csv_latin1_fallback")
+
+def estimate_csv_rows(csv_path):
+    """Rough row count from the file size and the line length at its start, without reading it all."""
+    size = os.path.getsize(csv_path)
+    with open(csv_path, "rb") as f:
+        sample = f.read(CSV_SNIFF_BYTES)
+    lines = sample.count(b"\n")
+    if len(sample) >= size or not lines:
+        return max(lines - 1, 0) # The whole file, minus the header
+    return int(size * lines / len(sample))
+
+def find_email_column(headers):
+    """Pick the email column; returns ``(name, warning)`` with name None when not found."""
+    # More robust email header detection
+    possible_headers = ['email', 'email address', 'email_address', 'e-mail', 'recipient']
+    if headers: # Check only if headers exist
+         for ph in possible_headers:
+             if ph in headers:
+                 return ph, None
+         # Still not found? Try finding any header containing 'mail'
+         for h in headers:
+             if 'mail' in h:
+                 return h, f"Warning: Standard 'email' header not found. Using '{h}' as the email column."
+    return None, None
+
+def create_recipient_validator(expected_rows=None):
+    """RecipientValidator configured from .env (deduplication and suppression list)."""
+    return RecipientValidator(
+        deduplicate=DEDUPLICATE_RECIPIENTS,
+        suppression=load_suppression_list(SUPPRESSION_LIST) if SUPPRESSION_LIST else None,
+        expected_rows=expected_rows,
+        bloom_above_rows=DEDUP_BLOOM_ABOVE_ROWS,
+        bloom_error_rate=DEDUP_BLOOM_ERROR_RATE,
+    )
+
+def iter_csv_recipients(rows, email_column_name, on_skip, validator=None, metrics=None):
+    """Validate CSV rows lazily, yielding recipient dicts for the send pipeline.
+
+    Addresses are normalized and checked by ``validator`` (syntax,
+    duplicates, suppression list; a default RecipientValidator if None).
+    Rows that cannot be sent are reported through ``on_skip(row_number, message, receiver)``.
+    """
+    if validator is None:
+        validator = RecipientValidator()
+    for i, row in enumerate(rows):
+        # Check if row is completely empty (can happen with extra newlines in CSV)
+        if not any(row.values()):
+            on_skip(i+2, f"Skipping row {i+2}: Empty row.", None) # +2 because header is row 1, data starts row 2
+            continue
+
+        with timed(metrics, "validate"):
+            receiver, problem = validator.check(row.get(email_column_name))
+        if problem is not None:
+            if metrics is not None:
+                metrics.count("recipients_rejected", reason=problem)
+            if problem == INVALID:
+                on_skip(i+2, f"Skipping row {i+2}: Invalid or missing email in '{email_column_name}' column ('{receiver}').", receiver)
+            elif problem == SUPPRESSED:
+                on_skip(i+2, f"Skipping row {i+2}: {receiver} is on the suppression list.", receiver)
+            elif problem == DUPLICATE:
+                certainty = "most likely " if validator.probabilistic else ""
+                on_skip(i+2, f"Skipping row {i+2}: {receiver} is {certainty}a duplicate of an earlier row.", receiver)
+            continue
+        yield {'email': receiver, 'data': row, 'row': i+2}
+
+def count_csv_rows(f, job):
+    """Set ``job.total`` to the number of data rows in the open CSV ``f``, then close it."""
+    with f:
+        rows, _ = process_csv_data(f)
+        job.total = sum(1 for _ in rows) if rows is not None else 0
+
+def load_csv_recipients(csv_path, encoding, email_column_name, job, remove_file=True):
+    """Stream recipients for a background job from a CSV saved on disk.
+
+    Rows are counted for ``job.total`` on a separate thread, so the first
+    email goes out without waiting for a pass over the whole file. The file
+    is deleted afterwards unless ``remove_file`` is False (stored campaigns
+    keep it until they finish).
+    """
+    try:
+        # Opened here, so the count still works if the file is removed first
+        counted = open_csv(csv_path, encoding)
+        threading.Thread(target=count_csv_rows, args=(counted, job), name=f"count-rows-{job.id}",
+                         daemon=True).start()
+
+        with open_csv(csv_path, encoding) as f:
+            rows, _ = process_csv_data(f)
+            if rows is not None:
+                rows = timed_iter(rows, job.metrics, "csv_parse")
+                # An estimate is enough to choose between exact and Bloom filter deduplication
+                validator = create_recipient_validator(expected_rows=estimate_csv_rows(csv_path))
+                yield from iter_csv_recipients(rows, email_column_name, job.skip, validator, job.metrics)
+    finally:
+        if remove_file:
+            try:
+                os.remove(csv_path)
+            except OSError:
+                pass
+
+def skip_delivered(recipients, journal_state, job):
+    """Leave out recipients an interrupted run of the campaign already delivered to.
+
+    The journal is fsynced more often than the report, so deliveries the
+    report lost in the crash are logged again from it.
+    """
+    delivered = len(journal_state.delivered_rows)
+    job.carry_over(delivered, f"Resumed: {delivered} recipient(s) delivered before the interruption were not sent again.")
+    for recipient_info in recipients:
+        row_number = recipient_info['row']
+        if row_number in journal_state.delivered_rows:
+            job.restore(row_number, f"SUCCESS: Row {row_number}: Sent to {recipient_info['email']} before the interruption.",
+                        recipient_info['email'])
+            continue
+        if journal_state.address_delivered(recipient_info['email']):
+            job.skip(row_number, f"Skipping row {row_number}: {recipient_info['email']} was already sent this campaign before it was interrupted.",
+                     recipient_info['email'])
+            continue
+        yield recipient_info
+
+def generate_message(template, row, headers):
+    """Fill one row into ``template``; kept as a public compatibility wrapper.
+
+    Replaces $header and ${header} (case-insensitive) in one pass, parsing the
+    template once per (template, headers). The send path doesn't call it:
+    run_campaign and render_outbound compile their templates up front with
+    compile_template, so the Markdown/HTML conversion also runs only once.
+    """
+    return compile_template(template, tuple(headers)).render(row)
+
+def extract_subject_and_body(content):
+    # Improved Title Extraction (handles attributes, case-insensitivity better)
+    pattern = r"<title[^>]*>(.*?)</title>"
+    match = re.search(pattern, content, re.IGNORECASE | re.DOTALL)
+    if match:
+        subj = match.group(1).strip()
+        # Remove the title tag and surrounding whitespace carefully
+        content = re.sub(pattern, "", content, count=1, flags=re.IGNORECASE | re.DOTALL).strip()
+        # Remove potential leftover empty lines at the beginning
+        content = re.sub(r"^\s*\n", "", content)
+        return subj, content
+
+    # Fallback: First non-empty, non-tag-like line as subject
+    lines = content.splitlines()
+    subj = "No Subject" # Default if no suitable line found
+    body_start_index = 0
+    for i, line in enumerate(lines):
+        stripped_line = line.strip()
+        if stripped_line: # Is it a non-empty line?
+             # Check if it looks like a tag
+             if not re.match(r"^\s*<", stripped_line):
+                 subj = stripped_line
+                 body_start_index = i + 1
+                 break # Found subject
+             else:
+                 # It's a tag-like line, assume no plain text subject exists before HTML
+                 body_start_index = i # Start body from this line
+                 break
+    body_content = "\n".join(lines[body_start_index:]).strip()
+    return subj, body_content
+
+def template_format(filename, content):
+    """``(is_markdown, is_plain_text, guessed)`` for a template file.
+
+    ``.md`` is Markdown and ``.txt`` plain text. Anything else is HTML unless
+    no common HTML tag shows up early, in which case it is taken to be
+    Markdown and ``guessed`` is True.
+    """
+    filename_lower = filename.lower()
+    if filename_lower.endswith('.md'):
+        return True, False, False
+    if filename_lower.endswith('.txt'):
+        return False, True, False
+    if not re.search(r'<html|<body|<div|<p|<br|</?a\s|</?img\s', content[:1000], re.IGNORECASE):
+        return True, False, True
+    return False, False, False
+
+def read_template(path):
+    """``(content, is_markdown, is_plain_text)`` of a template file (UTF-8, else Latin-1)."""
+    with open(path, "rb") as f:
+        content_bytes = f.read()
+    try:
+        content = content_bytes.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        content = content_bytes.decode("latin-1")
+    is_markdown, is_plain_text, _ = template_format(os.path.basename(path), content)
+    return content, is_markdown, is_plain_text
+
+
+def html_to_plain(html_message):
+    """Plain-text alternative for an HTML body."""
+    import html2text # Imported on first use (see the module docstring)
+    try:
+        h = html2text.HTML2Text()
+        h.ignore_links = False
+        h.body_width = 0 # Don't wrap lines
+        return h.handle(html_message)
+    except Exception as e:
+        print(f"Warning: Could not generate plain text: {e}")
+        return "HTML content could not be converted to plain text. Please view this email in an HTML-compatible client."
+
+
+def get_mx_resolver():
+    """The shared, caching MX resolver for direct delivery (created on first use)."""
+    global mx_resolver
+    if mx_resolver is None:
+        fallback = None if "*=" in DIRECT_MX_OVERRIDES.replace(" ", "") else DNSResolver(port=DIRECT_MX_PORT)
+        resolver = StaticResolver.parse(DIRECT_MX_OVERRIDES, fallback=fallback, port=DIRECT_MX_PORT) \
+            if DIRECT_MX_OVERRIDES.strip() else fallback
+        mx_resolver = CachedResolver(resolver, ttl=MX_CACHE_SECONDS)
+    return mx_resolver
+
+
+def create_smtp_pool(size=1, transport="threads", metrics=None):
+    """Build a connection pool for one campaign from the .env SMTP settings.
+
+    ``transport`` "asyncio" gives an AsyncSMTPPool for AsyncDeliveryEngine.
+    With DELIVERY_MODE "direct" the pool delivers to recipients' MX hosts
+    instead (threads transport only). SMTP timings and reply codes are
+    recorded to ``metrics`` when given.
+    """
+    if DELIVERY_MODE == "direct":
+        return DirectDeliveryPool(
+            get_mx_resolver(),
+            per_domain=DIRECT_MAX_CONNECTIONS_PER_DOMAIN,
+            per_host=DIRECT_MAX_CONNECTIONS_PER_HOST,
+            max_messages=SMTP_MAX_MESSAGES_PER_CONNECTION,
+            keepalive_interval=SMTP_KEEPALIVE_SECONDS,
+            timeout=SMTP_TIMEOUT_SECONDS,
+            smtp_factory=partial(smtplib.SMTP, local_hostname=DIRECT_HELO_HOSTNAME),
+            metrics=metrics,
+        )
+    pool_class = AsyncSMTPPool if transport == "asyncio" else SMTPConnectionPool
+    return pool_class(
+        MAILER_HOST, MAILER_PORT,
+        username=SENDER_EMAIL, password=PASSWORD,
+        size=size,
+        max_messages=SMTP_MAX_MESSAGES_PER_CONNECTION,
+        keepalive_interval=SMTP_KEEPALIVE_SECONDS,
+        timeout=SMTP_TIMEOUT_SECONDS,
+        starttls=SMTP_STARTTLS,
+        metrics=metrics,
+    )
+
+
+def compose_email(receiver, subject, html_message, attachments, display_name, plain_text=None, metrics=None):
+    """Serialize one email (HTML + plain text alternative + attachments) to bytes for sendmail.
+
+    The plain text alternative is generated from the HTML unless the caller
+    already has it. ``attachments`` is either a list of uploaded files,
+    encoded for this message only, or PreparedAttachments encoded once for a
+    whole campaign. Serialization is timed as the "mime" stage of ``metrics``.
+    """
+    # Generate plain text version
+    plain_text_message = plain_text if plain_text is not None else html_to_plain(html_message)
+
+    # Handle Attachments
+    if not isinstance(attachments, PreparedAttachments):
+        attachments = prepare_attachments(attachments)
+        for filename, e in attachments.errors:
+            # Decide whether to fail the whole email or just skip the attachment
+            print(f"Warning: Could not attach file {filename} for {receiver}. Error: {e}. Email sent without it.")
+
+    # Use the passed 'display_name' and format the From header correctly
+    with timed(metrics, "mime"):
+        return build_message(f"{display_name} <{SENDER_EMAIL}>", receiver, subject,
+                             plain_text_message, html_message, attachments)
+
+
+def describe_send_error(e, receiver, retry_transient=False):
+    """Log and describe a failed send to ``receiver``, for a ``(False, message)`` result.
+
+    With ``retry_transient``, temporary failures (4xx replies, dropped
+    connections) raise TransientDeliveryError instead.
+    """
+    if isinstance(e, smtplib.SMTPAuthenticationError):
+        error_msg = f"SMTP Authentication Error: {e}. Check SENDER_EMAIL and PASSWORD in .env."
+    elif isinstance(e, smtplib.SMTPServerDisconnected):
+        error_msg = f"SMTP Server Disconnected unexpectedly for {receiver}. Check connection/server limits."
+        if retry_transient:
+            print(error_msg)
+            raise TransientDeliveryError(error_msg) from e
+    elif isinstance(e, smtplib.SMTPException):
+        error_msg = f"SMTP Error sending to {receiver}: {e}"
+        if retry_transient and is_transient_smtp_error(e):
+            print(error_msg)
+            raise TransientDeliveryError(error_msg, smtp_error_code(e)) from e
+    elif isinstance(e, OSError): # Handle potential network/socket errors
+        error_msg = f"Network/OS Error sending to {receiver}: {e}"
+    else:
+        # Catch broader exceptions as a fallback
+        error_msg = f"An unexpected error occurred sending to {receiver}: {e.__class__.__name__} - {e}"
+    print(error_msg)
+    return error_msg
+
+
+def send_email(receiver, subject, html_message, attachments, display_name, smtp=None, plain_text=None,
+               retry_transient=False, metrics=None):
+    """Create and send an email with HTML, plain text, attachments, and custom display name.
+
+    See compose_email for ``plain_text`` and ``attachments``. With
+    ``retry_transient`` a temporary failure (4xx reply, dropped connection)
+    raises TransientDeliveryError instead of returning a failure, so the
+    caller can retry it later. ``metrics`` times composing the message.
+
+    When ``smtp`` (a connection pool or a pooled session) is given the message
+    goes out over a reused SMTP session; otherwise a one-off pool from
+    create_smtp_pool (same STARTTLS, timeout and delivery mode settings) is
+    opened and closed for this message.
+    """
+    if not sender_configured():
+        return False, "Sender email or password not configured."
+
+    message_bytes = compose_email(receiver, subject, html_message, attachments, display_name, plain_text, metrics)
+
+    # Send Email via SMTP
+    try:
+        if smtp is not None:
+            smtp.sendmail(SENDER_EMAIL, receiver, message_bytes)
+        else:
+            one_off = create_smtp_pool(metrics=metrics)
+            try:
+                one_off.sendmail(SENDER_EMAIL, receiver, message_bytes)
+            finally:
+                one_off.close() # QUITs the session
+        return True, f"Email successfully sent to {receiver}"
+    except Exception as e:
+        return False, describe_send_error(e, receiver, retry_transient)
+
+
+async def send_email_async(receiver, subject, html_message, attachments, display_name, smtp, plain_text=None,
+                           retry_transient=False, metrics=None):
+    """send_email over an async_smtp session (the asyncio transport)."""
+    if not sender_configured():
+        return False, "Sender email or password not configured."
+
+    message_bytes = compose_email(receiver, subject, html_message, attachments, display_name, plain_text, metrics)
+    try:
+        await smtp.sendmail(SENDER_EMAIL, receiver, message_bytes)
+        return True, f"Email successfully sent to {receiver}"
+    except Exception as e:
+        return False, describe_send_error(e, receiver, retry_transient)
+
+
+# To header of batched emails; the real recipients are only in the envelope
+BATCH_TO_HEADER = "undisclosed-recipients:;"
+
+
+def send_email_batch(receivers, subject, html_message, attachments, display_name, smtp, plain_text=None,
+                     retry_transient=False, metrics=None):
+    """Send one email to several recipients in a single SMTP transaction.
+
+    Recipients are only named in the envelope (one RCPT TO each), like Bcc,
+    and the To header reads "undisclosed-recipients:;". Returns
+    ``(success, message, refused)`` where ``refused`` maps every address the
+    server turned down to its ``(code, response)``. ``smtp`` is a connection
+    pool or pooled session; ``retry_transient`` works as in send_email for
+    failures of the whole transaction, and ``metrics`` as in send_email.
+    """
+    if not sender_configured():
+        return False, "Sender email or password not configured.", {}
+
+    message_bytes = compose_email(BATCH_TO_HEADER, subject, html_message, attachments, display_name, plain_text, metrics)
+    batch_label = f"a batch of {len(receivers)} recipients"
+    try:
+        refused = smtp.sendmail(SENDER_EMAIL, list(receivers), message_bytes)
+        return True, f"Email sent to {batch_label}", refused
+    except smtplib.SMTPRecipientsRefused as e:
+        # Every RCPT TO was refused, so there was no DATA phase
+        return False, f"All recipients refused in {batch_label}", e.recipients
+    except Exception as e:
+        return False, describe_send_error(e, batch_label, retry_transient), {}
+
+
+async def send_email_batch_async(receivers, subject, html_message, attachments, display_name, smtp, plain_text=None,
+                                 retry_transient=False, metrics=None):
+    """send_email_batch over an async_smtp session (the asyncio transport)."""
+    if not sender_configured():
+        return False, "Sender email or password not configured.", {}
+
+    message_bytes = compose_email(BATCH_TO_HEADER, subject, html_message, attachments, display_name, plain_text, metrics)
+    batch_label = f"a batch of {len(receivers)} recipients"
+    try:
+        refused = await smtp.sendmail(SENDER_EMAIL, list(receivers), message_bytes)
+        return True, f"Email sent to {batch_label}", refused
+    except smtplib.SMTPRecipientsRefused as e:
+        return False, f"All recipients refused in {batch_label}", e.recipients
+    except Exception as e:
+        return False, describe_send_error(e, batch_label, retry_transient), {}
+
+
+def batch_results(batch, success, message, refused):
+    """Per-recipient DeliveryResults for an OutboundBatch sent with send_email_batch.
+
+    Recipients refused with a 4xx reply are raised back to the delivery
+    engine as a smaller batch to retry, alongside the settled results.
+    """
+    results = []
+    retry = []
+    retry_code = None
+    for row_number, receiver in batch.recipients:
+        if receiver in refused:
+            code, response = refused[receiver]
+            if isinstance(response, bytes):
+                response = response.decode("utf-8", "replace")
+            reason = f"Recipient {receiver} refused by server: {code} {response}"
+            if 400 <= code < 500:
+                retry.append((row_number, receiver))
+                retry_code = code
+                print(reason)
+            else:
+                results.append(DeliveryResult(row_number, receiver, False, reason))
+        elif success:
+            results.append(DeliveryResult(row_number, receiver, True,
+                                          f"Email successfully sent to {receiver} (in a batch of {len(batch.recipients)})"))
+        else:
+            results.append(DeliveryResult(row_number, receiver, False, message))
+    if retry:
+        raise TransientDeliveryError(
+            f"Recipient temporarily refused by server ({retry_code})", retry_code,
+            settled=results, retry=batch._replace(recipients=tuple(retry)),
+        )
+    return results
+
+
+def parse_worker_count(value):
+    """Clamp a requested sender count to 1..MAX_SEND_WORKERS, defaulting to SEND_WORKERS."""
+    try:
+        workers = int(value)
+    except (TypeError, ValueError):
+        workers = SEND_WORKERS
+    return max(1, min(workers, MAX_SEND_WORKERS))
+
+
+def preconvert_template(email_content_raw, user_subject_template, headers, body_to_html, body_to_plain=html_to_plain):
+    """Convert the template itself to HTML and plain text, placeholders protected.
+
+    Returns ``(subject_template, html_template, plain_template)`` as compiled
+    templates; ``subject_template`` is None when the default subject applies.
+    """
+    if user_subject_template:
+        subject_template = compile_template(user_subject_template, headers)
+        body_source = email_content_raw
+    else:
+        template_subject, body_source = extract_subject_and_body(email_content_raw)
+        subject_template = None if template_subject == "No Subject" else compile_template(template_subject, headers)
+    html_template = compile_template(body_source, headers).convert(body_to_html)
+    plain_template = html_template.convert(body_to_plain)
+    return subject_template, html_template, plain_template
+
+
+def render_outbound(recipients, email_content_raw, user_subject_template, headers,
+                    is_markdown, is_plain_text, display_name, preconvert=False, metrics=None):
+    """Personalize the template for each recipient, lazily.
+
+    Yields an OutboundEmail per recipient, or a failed DeliveryResult when the
+    content could not be prepared, so rendering can run ahead of the senders.
+
+    Each personalized body is converted to HTML and plain text, with repeated
+    bodies served from a cache. With ``preconvert`` the template is converted
+    once instead and values are substituted straight into both outputs (they
+    are then inserted as-is, without Markdown or html2text processing).
+
+    Substitution, Markdown and html2text are timed as stages of ``metrics``.
+    """
+    # Configure Markdown parser (imported only for Markdown templates)
+    md = None
+    if is_markdown:
+        import markdown
+        md = markdown.Markdown(extensions=['extra', 'nl2br', 'smarty']) # Added smarty for quotes etc.
+
+    def body_to_html(body):
+        # Convert body to HTML if necessary
+        try:
+            if is_markdown:
+                with timed(metrics, "markdown"):
+                    return md.convert(body)
+            elif is_plain_text:
+                 # Convert plain text to basic HTML (preserving line breaks)
+                 return f"<pre style='font-family: sans-serif; white-space: pre-wrap;'>{body}</pre>"
+            else:
+                # Assume it's already HTML or the draft editor provided HTML
+                return body
+        finally:
+            # Reset markdown parser state for next email, crucial if using extensions with state
+            if md is not None:
+                md.reset()
+
+    def body_to_plain(html):
+        with timed(metrics, "html2text"):
+            return html_to_plain(html)
+
+    # Parse the templates once; each recipient is then a single-pass render
+    headers = tuple(headers)
+    default_subject = f"{display_name} Information" # More specific default
+
+    if preconvert:
+        try:
+            subject_template, html_template, plain_template = preconvert_template(
+                email_content_raw, user_subject_template, headers, body_to_html, body_to_plain)
+        except Exception as e:
+            print(f"Warning: Could not pre-convert the template ({e}); converting each email instead.")
+            preconvert = False
+        else:
+            for recipient_info in recipients:
+                row_data = recipient_info['data']
+                with timed(metrics, "substitute"):
+                    subject_line = subject_template.render(row_data) if subject_template else default_subject
+                    html_body, plain_body = html_template.render(row_data), plain_template.render(row_data)
+                yield OutboundEmail(recipient_info.get('row'), recipient_info['email'], subject_line,
+                                    html_body, plain_body)
+            return
+
+    body_template = compile_template(email_content_raw, headers)
+    subject_template = compile_template(user_subject_template, headers) if user_subject_template else None
+    converter = BodyConverter(body_to_html, body_to_plain, max_entries=RENDER_CACHE_SIZE)
+
+    for recipient_info in recipients:
+        receiver = recipient_info['email']
+        row_data = recipient_info['data']
+        row_number = recipient_info.get('row')
+
+        with timed(metrics, "substitute"):
+            personalized_content = body_template.render(row_data)
+            subject_line = subject_template.render(row_data) if subject_template else None
+
+        # Determine Subject
+        if subject_template:
+            body_to_process = personalized_content
+        else:
+            subject_line, body_to_process = extract_subject_and_body(personalized_content)
+            if subject_line == "No Subject":
+                 subject_line = default_subject
+
+        try:
+            final_html_body, plain_text_body = converter.convert(body_to_process)
+        except Exception as e:
+            yield DeliveryResult(row_number, receiver, False, f"Error preparing content for {receiver}: {e}. Skipping email.")
+            continue # Skip sending this email
+
+        yield OutboundEmail(row_number, receiver, subject_line, final_html_body, plain_text_body)
+
+
+def format_result_log(result):
+    """Log line for one delivery outcome, tagged with its CSV row when known."""
+    status = "SUCCESS" if result.success else "FAILED"
+    if result.row_number is None:
+        return f"{status}: {result.message}"
+    return f"{status}: Row {result.row_number}: {result.message}"
+
+
+def run_campaign(job, load_recipients, email_content_raw, user_subject_template, headers,
+                 is_markdown, is_plain_text, display_name, attachments, send_workers,
+                 preconvert=False, batch_identical_emails=False, campaign=None, resume=False,
+                 thread_context=None, dry_run=False, dry_run_output=ZIP, rate_limiter=None):
+    """Background job body: render and deliver every recipient, recording progress on ``job``.
+
+    ``load_recipients(job)`` returns the (possibly lazy) recipients to send to
+    and ``attachments`` are PreparedAttachments shared by every message. With
+    ``batch_identical_emails``, recipients whose emails come out identical
+    share SMTP transactions of up to SMTP_MAX_RECIPIENTS_PER_MESSAGE.
+
+    For a stored ``campaign`` every outcome is also written to its delivery
+    journal, and with ``resume`` recipients the journal lists as delivered
+    are skipped. The campaign is marked done once every row was processed.
+
+    Stage timings, outcomes and SMTP reply codes are collected on
+    ``job.metrics`` (and in the process-wide ``pipeline_metrics``).
+    ``thread_context`` is entered by every thread the delivery engine uses.
+    Sends are paced by ``rate_limiter``, by default the process-wide
+    ``send_rate_limiter`` that all campaigns share.
+
+    With ``dry_run`` every message is rendered and assembled the same way but
+    written to DRY_RUN_DIR (``dry_run_output``: zip, directory or none)
+    instead of opening SMTP connections; the writer is kept as ``job.dry_run``.
+    """
+    metrics = job.metrics = PipelineMetrics(parent=pipeline_metrics)
+    source = load_recipients(job)
+    recipients = source
+    journal = None
+    if campaign is not None:
+        if resume:
+            recipients = skip_delivered(source, campaign.journal_state(), job)
+        journal = job.journal = campaign.open_journal(flush_every=JOURNAL_FLUSH_EVERY,
+                                                      flush_interval=JOURNAL_FLUSH_SECONDS)
+    # Render while `send_workers` senders, each owning one pooled SMTP
+    # session, do the network I/O (threads, or tasks on one event loop)
+    outbound = render_outbound(recipients, email_content_raw, user_subject_template, headers,
+                               is_markdown, is_plain_text, display_name, preconvert=preconvert, metrics=metrics)
+    direct = DELIVERY_MODE == "direct" and not dry_run
+    if batch_identical_emails and SMTP_MAX_RECIPIENTS_PER_MESSAGE > 1:
+        # A direct-delivery transaction can only carry recipients of one domain
+        group_key = (lambda item: recipient_domain(item.receiver)) if direct else None
+        outbound = batch_identical(outbound, SMTP_MAX_RECIPIENTS_PER_MESSAGE, group_key=group_key)
+    if direct:
+        # Spread the senders over many domains rather than queueing them behind
+        # one domain's DIRECT_MAX_CONNECTIONS_PER_DOMAIN
+        outbound = interleave_domains(outbound)
+
+    def deliver(item, smtp):
+        if isinstance(item, OutboundBatch):
+            success, message, refused = send_email_batch(
+                [receiver for _, receiver in item.recipients], item.subject, item.html_body,
+                attachments, display_name, smtp, plain_text=item.plain_body, retry_transient=True, metrics=metrics)
+            return batch_results(item, success, message, refused)
+        return send_email(item.receiver, item.subject, item.html_body, attachments, display_name,
+                          smtp=smtp, plain_text=item.plain_body, retry_transient=True, metrics=metrics)
+
+    async def deliver_async(item, smtp):
+        if isinstance(item, OutboundBatch):
+            success, message, refused = await send_email_batch_async(
+                [receiver for _, receiver in item.recipients], item.subject, item.html_body,
+                attachments, display_name, smtp, plain_text=item.plain_body, retry_transient=True, metrics=metrics)
+            return batch_results(item, success, message, refused)
+        return await send_email_async(item.receiver, item.subject, item.html_body, attachments, display_name,
+                                      smtp, plain_text=item.plain_body, retry_transient=True, metrics=metrics)
+
+    def rehearse(item, writer):
+        # Dry run: everything send_email does except the SMTP conversation
+        batch = isinstance(item, OutboundBatch)
+        message_bytes = compose_email(BATCH_TO_HEADER if batch else item.receiver, item.subject, item.html_body,
+                                      attachments, display_name, item.plain_body, metrics)
+        writer.write([receiver for _, receiver in recipients_of(item)], message_bytes)
+        if batch:
+            return [DeliveryResult(row_number, receiver, True,
+                                   f"Rendered email for {receiver} (in a batch of {len(item.recipients)}, not sent)")
+                    for row_number, receiver in item.recipients]
+        return True, f"Rendered email for {item.receiver} ({len(message_bytes)} bytes, not sent)"
+
+    def record(result):
+        if journal is not None:
+            journal.record(result.row_number, result.receiver, SENT if result.success else FAILED,
+                           None if result.success else result.message)
+        job.record(result.success, result.row_number, format_result_log(result), result.receiver, result.message)
+
+    use_asyncio = SMTP_TRANSPORT == "asyncio" and not direct and not dry_run
+    if dry_run:
+        extension = ".zip" if dry_run_output == ZIP else ""
+        output_path = None if dry_run_output == DISCARD else os.path.join(DRY_RUN_DIR, job.id + extension)
+        smtp_pool = job.dry_run = EmlWriter(output_path, dry_run_output, sample_size=DRY_RUN_SAMPLE_SIZE)
+    else:
+        smtp_pool = create_smtp_pool(size=send_workers, transport="asyncio" if use_asyncio else "threads",
+                                     metrics=metrics)
+    try:
+        if dry_run:
+            # Rendering is CPU-bound; one writer thread behind the render thread is enough
+            engine = DeliveryEngine(smtp_pool, rehearse, workers=1, thread_context=thread_context)
+        else:
+            engine_class = AsyncDeliveryEngine if use_asyncio else DeliveryEngine
+            engine = engine_class(
+                smtp_pool, deliver_async if use_asyncio else deliver, workers=send_workers,
+                rate_limiter=send_rate_limiter if rate_limiter is None else rate_limiter,
+                # Halve parallel sends whenever the relay answers 4xx, regrow on success.
+                # Direct delivery does this per domain (DirectDeliveryPool), so one
+                # throttling domain doesn't slow the rest.
+                concurrency=None if direct else AdaptiveConcurrency(send_workers),
+                max_retries=SMTP_MAX_RETRIES,
+                retry_backoff=SMTP_RETRY_BACKOFF_SECONDS,
+                max_backoff=SMTP_MAX_BACKOFF_SECONDS,
+                thread_context=thread_context,
+            )
+        try:
+            engine.run(outbound, record)
+        finally:
+            metrics.count("retries", engine.retries)
+    finally:
+        smtp_pool.close()
+        if hasattr(source, "close"):
+            source.close() # Lets a streaming source clean up its file
+        if journal is not None:
+            journal.close()
+    if campaign is not None:
+        campaign.mark_done()
+
+
+def run_profiled_campaign(job, *args, **kwargs):
+    """run_campaign under cProfile, covering the job thread and every sender.
+
+    The merged report is saved to PROFILE_DIR and its path kept on the job.
+    """
+    profiler = CampaignProfiler()
+    try:
+        with profiler.thread():
+            run_campaign(job, *args, thread_context=profiler.thread, **kwargs)
+    finally:
+        job.profile_path = profiler.save(PROFILE_DIR, job.id)
+
+
+def start_stored_campaign(campaign, resume=False):
+    """Queue a bulk campaign saved in the campaign store, under its own id."""
+    settings = campaign.settings
+    load_recipients = partial(load_csv_recipients, campaign.csv_path, settings['csv_encoding'],
+                              settings['email_column_name'], remove_file=False)
+    # Campaigns started with their own send rate keep it when resumed
+    rate_limits = settings.get('rate_limits')
+    return campaign_jobs.submit(
+        run_profiled_campaign if settings.get('profile') else run_campaign,
+        load_recipients, settings['email_content_raw'], settings['user_subject_template'],
+        settings['headers'], settings['is_markdown'], settings['is_plain_text'], settings['display_name'],
+        campaign.attachments(), settings['send_workers'],
+        preconvert=settings['preconvert'], batch_identical_emails=settings['batch_identical_emails'],
+        campaign=campaign, resume=resume, job_id=campaign.id,
+        rate_limiter=RateLimiter(**rate_limits) if rate_limits else None,
+    )
+
+
+def start_campaign(csv_path, template_path, subject="", attachments=(), display_name=None,
+                   workers=None, rate_per_second=None, rate_per_minute=None, rate_per_day=None,
+                   preconvert=None, batch_identical_emails=None, dry_run=False, dry_run_output=ZIP,
+                   profile=False):
+    """Queue a bulk campaign from files on disk and return its CampaignJob at once.
+
+    ``template_path`` is an .html, .md or .txt template and an empty
+    ``subject`` takes the subject from it, as on the web form.
+    ``attachments`` are file paths. Options left as None use the .env
+    defaults; any ``rate_per_*`` limit gives this campaign its own
+    RateLimiter instead of the shared SEND_RATE_* quotas.
+
+    A real send is saved in the campaign store like one from the web form
+    (the CSV is copied; ``csv_path`` is left alone), so if the process dies
+    ``resume_campaign(job.id)`` finishes it without mailing anyone twice. A
+    dry run streams the CSV in place and is not stored.
+
+    Raises ValueError for an unusable CSV, OSError for unreadable files and
+    RuntimeError when no sender is configured (dry runs don't need one).
+    """
+    if not dry_run and not sender_configured():
+        raise RuntimeError("SENDER_EMAIL and PASSWORD must be set in the .env file.")
+    email_content_raw, is_markdown, is_plain_text = read_template(template_path)
+    attachments = read_attachments(attachments)
+
+    # Only the header is parsed here; rows are streamed by the job
+    csv_encoding = detect_csv_encoding(csv_path)
+    with open_csv(csv_path, csv_encoding) as f:
+        rows, headers = process_csv_data(f)
+    if rows is None:
+        raise ValueError(f"Error processing {csv_path}. Check format, encoding, and headers.")
+    email_column_name, column_warning = find_email_column(headers)
+    if column_warning:
+        print(column_warning)
+    if email_column_name is None:
+        raise ValueError(f"CSV must contain a recognized email header (e.g., 'email', 'email_address'). Found: {', '.join(headers) if headers else 'None'}")
+
+    settings = {
+        'email_content_raw': email_content_raw,
+        'user_subject_template': (subject or "").strip(),
+        'headers': list(headers),
+        'is_markdown': is_markdown,
+        'is_plain_text': is_plain_text,
+        'display_name': display_name or DEFAULT_DISPLAY_NAME,
+        'send_workers': parse_worker_count(workers),
+        'preconvert': PRECONVERT_TEMPLATES if preconvert is None else preconvert,
+        'batch_identical_emails': BATCH_IDENTICAL_EMAILS if batch_identical_emails is None else batch_identical_emails,
+        'csv_encoding': csv_encoding,
+        'email_column_name': email_column_name,
+        'profile': profile,
+    }
+    rate_limits = None
+    if rate_per_second or rate_per_minute or rate_per_day:
+        rate_limits = {'per_second': rate_per_second, 'per_minute': rate_per_minute, 'per_day': rate_per_day}
+    if not dry_run:
+        campaign = campaign_store.create(uuid.uuid4().hex, csv_path, dict(settings, rate_limits=rate_limits),
+                                         attachments, copy=True)
+        return start_stored_campaign(campaign)
+
+    load_recipients = partial(load_csv_recipients, csv_path, csv_encoding, email_column_name, remove_file=False)
+    return campaign_jobs.submit(
+        run_profiled_campaign if profile else run_campaign, load_recipients, settings['email_content_raw'],
+        settings['user_subject_template'], settings['headers'], is_markdown, is_plain_text,
+        settings['display_name'], attachments, settings['send_workers'],
+        preconvert=settings['preconvert'], batch_identical_emails=settings['batch_identical_emails'],
+        dry_run=True, dry_run_output=dry_run_output,
+        rate_limiter=RateLimiter(**rate_limits) if rate_limits else None,
+    )
+
+
+def resume_campaign(campaign_id):
+    """Continue an interrupted stored campaign and return its CampaignJob at once.
+
+    Recipients its journal lists as delivered are not sent to again. Raises
+    ValueError for an unknown, finished or still running campaign and
+    RuntimeError when no sender is configured.
+    """
+    campaign = campaign_store.get(campaign_id)
+    if campaign is None:
+        raise ValueError(f"No saved campaign with id {campaign_id!r} in {campaign_store.root}.")
+    if campaign.finished:
+        raise ValueError(f"Campaign {campaign_id} already finished; there is nothing left to send.")
+    job = campaign_jobs.get(campaign_id)
+    if job is not None and not job.finished:
+        raise ValueError(f"Campaign {campaign_id} is still running.")
+    if not sender_configured():
+        raise RuntimeError("SENDER_EMAIL and PASSWORD must be set in the .env file.")
+    return start_stored_campaign(campaign, resume=True)
+
+
+def send_campaign(*args, progress=None, progress_interval=1.0, **kwargs):
+    """start_campaign, then wait for the campaign to finish and return its CampaignJob.
+
+    ``progress(job)`` is called every ``progress_interval`` seconds meanwhile.
+    """
+    job = start_campaign(*args, **kwargs)
+    while not job.wait(progress_interval):
+        if progress is not None:
+            progress(job)
+    return job
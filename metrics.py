@@ -0,0 +1,195 @@
+"""Timing histograms and counters for the send pipeline.
+
+Every campaign gets its own PipelineMetrics, chained to the process-wide one
+served on ``/metrics``, so a slow campaign can be broken down by stage (CSV
+parsing, recipient validation, substitution, Markdown, html2text, MIME
+serialization, SMTP connect/login/send) and the app as a whole can be scraped in the Prometheus
+text format.
+"""
+import bisect
+import smtplib
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Upper bounds in seconds, from parsing one CSV row to a slow relay
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Pipeline stages in the order a message goes through them
+STAGES = ("csv_parse", "validate", "substitute", "markdown", "html2text", "mime",
+          "mx_resolve", "smtp_connect", "smtp_login", "smtp_send")
+
+
+class Histogram:
+    """Bucketed distribution of observed durations."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # Last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Estimate of the ``q`` quantile, interpolated within its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / bucket_count, self.max)
+            seen += bucket_count
+        return self.max
+
+
+class PipelineMetrics:
+    """Stage timings and labelled counters; observations also go to ``parent``."""
+
+    def __init__(self, parent=None, buckets=DEFAULT_BUCKETS):
+        self.parent = parent
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+        if self.parent is not None:
+            self.parent.observe(stage, seconds)
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def count(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+        if self.parent is not None:
+            self.parent.count(name, amount, **labels)
+
+    def smtp_reply(self, code):
+        """Count one SMTP reply code (or "disconnected" when there was no reply)."""
+        self.count("smtp_replies", code=str(code))
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def counters(self, name):
+        """``{labels: value}`` for every label set of counter ``name``."""
+        with self._lock:
+            return {labels: value for (counter, labels), value in self._counters.items() if counter == name}
+
+    def stage_summary(self):
+        """Per-stage rows for a campaign's result page, in pipeline order."""
+        with self._lock:
+            histograms = dict(self._histograms)
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        rows = []
+        for stage in sorted(histograms, key=lambda stage: (order.get(stage, len(order)), stage)):
+            histogram = histograms[stage]
+            rows.append({
+                "stage": stage,
+                "count": histogram.count,
+                "total_seconds": histogram.sum,
+                "mean_ms": histogram.sum / histogram.count * 1000 if histogram.count else 0.0,
+                "p50_ms": histogram.quantile(0.50) * 1000,
+                "p95_ms": histogram.quantile(0.95) * 1000,
+                "p99_ms": histogram.quantile(0.99) * 1000,
+                "max_ms": histogram.max * 1000,
+            })
+        return rows
+
+    def render_prometheus(self, prefix="bulkmail"):
+        """The metrics in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = {stage: (list(h.counts), h.count, h.sum) for stage, h in self._histograms.items()}
+            counters = dict(self._counters)
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent in each stage of the send pipeline.",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        for stage in sorted(histograms):
+            counts, count, total = histograms[stage]
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {count}')
+
+        names = sorted({name for name, _ in counters})
+        for name in names:
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            for (counter, labels), value in sorted(counters.items()):
+                if counter != name:
+                    continue
+                label_text = ",".join(f'{key}="{_escape(value_)}"' for key, value_ in labels)
+                lines.append(f"{prefix}_{name}_total{{{label_text}}} {value}" if label_text
+                             else f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def count_smtp_replies(metrics, refused=None, error=None):
+    """Count the reply codes of one sendmail: 250 plus refused RCPTs, or the error's codes."""
+    if metrics is None:
+        return
+    if error is None:
+        metrics.smtp_reply(250)
+        for code, _ in (refused or {}).values():
+            metrics.smtp_reply(code)
+    elif isinstance(error, smtplib.SMTPRecipientsRefused):
+        for code, _ in error.recipients.values():
+            metrics.smtp_reply(code)
+    elif isinstance(error, smtplib.SMTPResponseException):
+        metrics.smtp_reply(error.smtp_code)
+    elif isinstance(error, smtplib.SMTPServerDisconnected):
+        metrics.smtp_reply("disconnected")
+    else:
+        metrics.smtp_reply("error")
+
+
+def timed_iter(iterable, metrics, stage):
+    """Yield from ``iterable``, timing how long each item takes to produce."""
+    if metrics is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        metrics.observe(stage, time.perf_counter() - start)
+        yield item
+
+
+def timed(metrics, stage):
+    """``metrics.time(stage)``, or a no-op when there are no metrics to record to."""
+    return metrics.time(stage) if metrics is not None else nullcontext()
@@ -0,0 +1,107 @@
+"""Recipient-invariant MIME parts, encoded once per campaign.
+
+Attachments are the same for every recipient of a campaign, so they are read,
+base64-encoded and serialized a single time. Each message then only builds
+its personalized text/HTML part and headers, and the pre-serialized
+attachment bytes are spliced in after it.
+"""
+import email.policy
+import os
+from email import encoders
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+# Same header folding as Message.as_string(), but with the CRLF line endings
+# SMTP expects (smtplib sends bytes as-is)
+SMTP_POLICY = email.policy.compat32.clone(linesep="\r\n")
+
+
+class PreparedAttachments:
+    """Attachment parts already serialized to wire format."""
+
+    def __init__(self, parts=(), errors=()):
+        # (filename, serialized MIME part) pairs
+        self.parts = list(parts)
+        # (filename, exception) pairs for files that could not be attached
+        self.errors = list(errors)
+
+    def __bool__(self):
+        return bool(self.parts)
+
+    def __len__(self):
+        return len(self.parts)
+
+
+def encode_attachment(filename, file_data):
+    """``(safe filename, serialized MIME part)`` for one attachment."""
+    # Werkzeug is only needed once there is something to attach
+    from werkzeug.utils import secure_filename
+    filename = secure_filename(filename)
+    if not filename: # secure_filename might return empty string for weird names
+         filename = "attachment" # Provide a default name
+    attach_part = MIMEBase("application", "octet-stream")
+    attach_part.set_payload(file_data)
+    encoders.encode_base64(attach_part)
+    attach_part.add_header("Content-Disposition", f"attachment; filename=\"{filename}\"") # Use quotes for filenames with spaces
+    return filename, attach_part.as_bytes(policy=SMTP_POLICY)
+
+
+def prepare_attachments(files):
+    """Read and encode uploaded files once, returning PreparedAttachments."""
+    parts = []
+    errors = []
+    for file in files or ():
+        # Ensure file object is valid and has a filename
+        if not (file and hasattr(file, 'filename') and file.filename):
+            continue
+        try:
+            file.seek(0) # Ensure reading from the start
+            file_data = file.read()
+            file.seek(0) # Reset pointer if file needs to be read again elsewhere
+            parts.append(encode_attachment(file.filename, file_data))
+        except Exception as e:
+            errors.append((getattr(file, 'filename', 'N/A'), e))
+    return PreparedAttachments(parts, errors)
+
+
+def read_attachments(paths):
+    """Read and encode files on disk once; OSError if one cannot be read."""
+    parts = []
+    for path in paths or ():
+        with open(path, "rb") as f:
+            parts.append(encode_attachment(os.path.basename(path), f.read()))
+    return PreparedAttachments(parts)
+
+
+def build_message(from_header, receiver, subject, plain_text, html, attachments=None):
+    """Serialize one message to bytes ready for ``sendmail``.
+
+    Without attachments this is a multipart/alternative of the plain text and
+    HTML bodies. With attachments, that alternative part is wrapped in a
+    multipart/mixed and the prepared attachment bytes are appended verbatim.
+    """
+    body = MIMEMultipart("alternative")
+    body.attach(MIMEText(plain_text, "plain", "utf-8"))
+    body.attach(MIMEText(html, "html", "utf-8"))
+
+    message = MIMEMultipart("mixed") if attachments else body
+    message["Subject"] = subject
+    message["From"] = from_header
+    message["To"] = receiver
+    if not attachments:
+        return message.as_bytes(policy=SMTP_POLICY)
+
+    message.attach(body)
+    serialized = message.as_bytes(policy=SMTP_POLICY)
+    # The generator picked the boundary while serializing; splice the
+    # attachment parts in front of the closing delimiter
+    delimiter = b"\r\n--" + message.get_boundary().encode("ascii")
+    close_at = serialized.rindex(delimiter + b"--")
+    chunks = [serialized[:close_at]]
+    for _, part in attachments.parts:
+        chunks.append(delimiter)
+        chunks.append(b"\r\n")
+        chunks.append(part)
+    chunks.append(serialized[close_at:])
+    return b"".join(chunks)
@@ -0,0 +1,336 @@
+"""Direct delivery: send to each recipient domain's MX hosts instead of a relay.
+
+Recipients of different domains are interleaved, each domain's MX records
+are looked up once and cached for their TTL, and every MX host gets its own
+pool of reusable sessions. Concurrency is capped per domain (simultaneous
+transactions, halved while the domain answers 4xx) and per MX host (open
+connections), as receiving servers throttle senders that open too many of
+either.
+
+Resolvers are plain objects with ``lookup(domain) -> (records, ttl)``, so
+StaticResolver can route every domain to local stand-in servers. The DNS
+resolver needs ``pip install dnspython``, imported only when it is used.
+"""
+import smtplib
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import NamedTuple
+
+from delivery import OutboundBatch, OutboundEmail, recipients_of
+from metrics import timed
+from smtp_pool import OPPORTUNISTIC_TLS, SMTPConnectionPool
+from throttle import AdaptiveConcurrency, is_transient_smtp_error
+
+SMTP_PORT = 25
+
+
+class MXRecord(NamedTuple):
+    preference: int
+    host: str
+    port: int = SMTP_PORT
+
+
+class DeliveryRouteError(smtplib.SMTPConnectError):
+    """No usable route to a domain; a 4xx ``smtp_code`` means it is worth retrying later."""
+
+
+def recipient_domain(address):
+    return address.rpartition("@")[2].rstrip(".").lower()
+
+
+def parse_target(target, default_port=SMTP_PORT):
+    """``"host"`` or ``"host:port"`` as ``(host, port)``."""
+    host, sep, port = target.strip().rpartition(":")
+    if not sep or not port.isdigit():
+        return target.strip(), default_port
+    return host, int(port)
+
+
+class DNSResolver:
+    """MX lookups through dnspython.
+
+    Domains without MX records fall back to the domain itself (the implicit
+    MX of RFC 5321), and a null MX (RFC 7505) is a permanent failure.
+    """
+
+    def __init__(self, timeout=10.0, port=SMTP_PORT):
+        try:
+            import dns.resolver
+        except ImportError:
+            raise RuntimeError("Direct delivery needs dnspython: pip install dnspython") from None
+        self._dns = dns
+        self._resolver = dns.resolver.Resolver()
+        self._resolver.lifetime = timeout
+        self.port = port
+
+    def lookup(self, domain):
+        dns = self._dns
+        try:
+            answer = self._resolver.resolve(domain, "MX")
+        except dns.resolver.NXDOMAIN:
+            raise DeliveryRouteError(550, f"Domain {domain} does not exist") from None
+        except dns.resolver.NoAnswer:
+            return [MXRecord(0, domain, self.port)], None
+        except dns.exception.DNSException as e:
+            raise DeliveryRouteError(451, f"MX lookup for {domain} failed: {e}") from None
+        records = [MXRecord(r.preference, r.exchange.to_text(omit_final_dot=True), self.port) for r in answer]
+        if len(records) == 1 and records[0].host in ("", "."):
+            raise DeliveryRouteError(556, f"Domain {domain} does not accept mail (null MX)")
+        return records, answer.rrset.ttl
+
+
+class StaticResolver:
+    """Fixed MX targets per domain, e.g. local stand-in servers for testing.
+
+    ``routes`` maps a domain (or ``"*"`` for every other domain) to
+    ``"host[:port]"`` targets in order of preference. Domains without a
+    route go to ``fallback`` (another resolver), else fail permanently.
+    """
+
+    def __init__(self, routes, fallback=None, port=SMTP_PORT):
+        self.routes = {}
+        for domain, targets in routes.items():
+            if isinstance(targets, str):
+                targets = [targets]
+            self.routes[domain.lower()] = [MXRecord(i * 10, *parse_target(target, port))
+                                           for i, target in enumerate(targets)]
+        self.fallback = fallback
+
+    @classmethod
+    def parse(cls, text, fallback=None, port=SMTP_PORT):
+        """Routes from ``"example.com=host:2525|backup:2525,*=host:2526"``."""
+        routes = {}
+        for entry in text.split(","):
+            domain, sep, targets = entry.partition("=")
+            if sep and domain.strip():
+                routes[domain.strip()] = [target for target in targets.split("|") if target.strip()]
+        return cls(routes, fallback=fallback, port=port)
+
+    def lookup(self, domain):
+        records = self.routes.get(domain)
+        if records is None and self.fallback is not None:
+            return self.fallback.lookup(domain)
+        records = records if records is not None else self.routes.get("*")
+        if not records:
+            raise DeliveryRouteError(550, f"No route configured for domain {domain}")
+        return list(records), None
+
+
+class CachedResolver:
+    """Caches another resolver's answers per domain.
+
+    Answers are kept for their DNS TTL, at most ``ttl`` seconds; failures
+    for ``negative_ttl``. Concurrent lookups of one domain share a single
+    query.
+    """
+
+    def __init__(self, resolver, ttl=300.0, negative_ttl=60.0, clock=time.monotonic):
+        self.resolver = resolver
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.lookups = 0
+        self.hits = 0
+        self._cache = {}
+        self._lookup_locks = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, domain):
+        """MX records for ``domain``, most preferred first; raises DeliveryRouteError."""
+        domain = domain.rstrip(".").lower()
+        with self._lock:
+            cached = self._fresh(domain)
+            if cached is None:
+                lookup_lock = self._lookup_locks.setdefault(domain, threading.Lock())
+        if cached is None:
+            with lookup_lock:
+                with self._lock:
+                    cached = self._fresh(domain)
+                if cached is None:
+                    cached = self._lookup(domain)
+        records, error = cached
+        if error is not None:
+            raise error
+        return records
+
+    def _fresh(self, domain):
+        entry = self._cache.get(domain)
+        if entry is None or entry[0] <= self.clock():
+            return None
+        self.hits += 1
+        return entry[1:]
+
+    def _lookup(self, domain):
+        self.lookups += 1
+        try:
+            records, ttl = self.resolver.lookup(domain)
+        except DeliveryRouteError as e:
+            entry = (self.clock() + self.negative_ttl, None, e)
+        else:
+            ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+            entry = (self.clock() + ttl, sorted(records), None)
+        with self._lock:
+            self._cache[domain] = entry
+            self._lookup_locks.pop(domain, None)
+        return entry[1:]
+
+
+def interleave_domains(items, lookahead=256):
+    """Reorder outbound items so consecutive ones go to different recipient domains.
+
+    Up to ``lookahead`` items are read ahead into per-domain queues and handed
+    out round-robin, so parallel senders spread over every domain in the
+    window instead of all waiting on one domain's connection cap. Sessions
+    are pooled per MX host, so they stay warm without sending a domain's
+    messages back to back. DeliveryResults pass straight through.
+    """
+    queues = OrderedDict() # domain -> deque of items, in round-robin order
+    buffered = 0
+
+    def take():
+        domain, pending = next(iter(queues.items()))
+        item = pending.popleft()
+        if pending:
+            queues.move_to_end(domain)
+        else:
+            del queues[domain]
+        return item
+
+    for item in items:
+        if not isinstance(item, (OutboundEmail, OutboundBatch)):
+            yield item
+            continue
+        domain = recipient_domain(recipients_of(item)[0][1])
+        pending = queues.get(domain)
+        if pending is None:
+            pending = queues[domain] = deque()
+        pending.append(item)
+        buffered += 1
+        if buffered >= lookahead:
+            buffered -= 1
+            yield take()
+    while queues:
+        yield take()
+
+
+class DirectSession:
+    """What a delivery engine's sender holds in direct mode; routes each message by domain."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        if isinstance(to_addrs, str):
+            to_addrs = [to_addrs]
+        domains = {recipient_domain(address) for address in to_addrs}
+        if len(domains) != 1:
+            raise ValueError("Direct delivery sends each message to a single recipient domain")
+        return self.pool.deliver(domains.pop(), from_addr, to_addrs, msg)
+
+
+class DirectDeliveryPool:
+    """Per-MX-host SMTPConnectionPools behind one pool-like object.
+
+    Works with DeliveryEngine like SMTPConnectionPool: senders take a
+    ``session()`` and call its ``sendmail``. MX hosts of a domain are tried
+    in order of preference until one accepts a connection. Each domain has
+    its own AdaptiveConcurrency of up to ``per_domain`` transactions, so a
+    domain that pushes back is slowed down without slowing the others.
+    """
+
+    def __init__(self, resolver, per_domain=2, per_host=4, max_messages=100, keepalive_interval=30,
+                 timeout=30, starttls=OPPORTUNISTIC_TLS, smtp_factory=smtplib.SMTP,
+                 clock=time.monotonic, metrics=None):
+        self.resolver = resolver
+        self.per_domain = max(1, int(per_domain))
+        self.per_host = max(1, int(per_host))
+        self.max_messages = max_messages
+        self.keepalive_interval = keepalive_interval
+        self.timeout = timeout
+        self.starttls = starttls
+        self.smtp_factory = smtp_factory
+        self.clock = clock
+        self.metrics = metrics
+        self._destinations = {}
+        self._domain_slots = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @contextmanager
+    def session(self):
+        if self._closed:
+            raise RuntimeError("SMTP connection pool is closed")
+        yield DirectSession(self)
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        return DirectSession(self).sendmail(from_addr, to_addrs, msg)
+
+    def destination(self, host, port):
+        """The session pool for one MX host."""
+        with self._lock:
+            pool = self._destinations.get((host, port))
+            if pool is None:
+                pool = self._destinations[(host, port)] = SMTPConnectionPool(
+                    host, port, size=self.per_host, max_messages=self.max_messages,
+                    keepalive_interval=self.keepalive_interval, timeout=self.timeout,
+                    starttls=self.starttls, smtp_factory=self.smtp_factory,
+                    clock=self.clock, metrics=self.metrics,
+                )
+            return pool
+
+    def slots(self, domain):
+        """The AdaptiveConcurrency capping transactions to one domain."""
+        with self._lock:
+            slots = self._domain_slots.get(domain)
+            if slots is None:
+                slots = self._domain_slots[domain] = AdaptiveConcurrency(self.per_domain)
+            return slots
+
+    def deliver(self, domain, from_addr, to_addrs, msg):
+        with timed(self.metrics, "mx_resolve"):
+            records = self.resolver.resolve(domain)
+        slots = self.slots(domain)
+        last_error = None
+        slots.acquire()
+        try:
+            for record in records:
+                destination = self.destination(record.host, record.port)
+                try:
+                    with destination.session() as session:
+                        refused = session.sendmail(from_addr, to_addrs, msg)
+                except (smtplib.SMTPConnectError, smtplib.SMTPHeloError,
+                        smtplib.SMTPServerDisconnected) as e:
+                    # This MX could not be reached or dropped us; try the next one
+                    last_error = e
+                    continue
+                except smtplib.SMTPException as e:
+                    # The MX answered (SMTPException is an OSError, so this comes first)
+                    if is_transient_smtp_error(e):
+                        slots.backoff()
+                    raise
+                except OSError as e:
+                    last_error = e
+                    continue
+                if any(400 <= code < 500 for code, _ in refused.values()):
+                    slots.backoff()
+                else:
+                    slots.succeeded()
+                return refused
+            slots.backoff()
+        finally:
+            slots.release()
+        raise DeliveryRouteError(451, f"No MX host for {domain} could take the message (last error: {last_error})")
+
+    @property
+    def connections_opened(self):
+        with self._lock:
+            return sum(pool.connections_opened for pool in self._destinations.values())
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            destinations = list(self._destinations.values())
+        for pool in destinations:
+            pool.close()
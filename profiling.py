@@ -0,0 +1,58 @@
+"""Optional cProfile capture for a single campaign run.
+
+cProfile only sees the thread that enabled it, so the campaign thread and
+every sender thread (or render hop, for the asyncio transport) enter
+``profiler.thread()`` and the per-thread profiles are merged at the end.
+"""
+import cProfile
+import io
+import os
+import pstats
+import threading
+from contextlib import contextmanager
+
+
+class CampaignProfiler:
+    """Collects cProfile data from every thread working on one campaign."""
+
+    def __init__(self):
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def thread(self):
+        """Profile the calling thread for the duration of the ``with`` block."""
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                self._profiles.append(profile)
+
+    def stats(self):
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def save(self, directory, name, limit=40):
+        """Write ``name.prof`` (for snakeviz etc.) and a ``name.txt`` report; returns the report path."""
+        stats = self.stats()
+        if stats is None:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        stats.dump_stats(os.path.join(directory, f"{name}.prof"))
+        report = io.StringIO()
+        stats.stream = report
+        stats.sort_stats("cumulative").print_stats(limit)
+        stats.sort_stats("tottime").print_stats(limit)
+        report_path = os.path.join(directory, f"{name}.txt")
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(report.getvalue())
+        return report_path
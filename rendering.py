@@ -0,0 +1,35 @@
+"""Caching for the per-recipient body conversions.
+
+Markdown to HTML and HTML to plain text are full parses. When the
+personalized body source repeats (no placeholders, or the same values on many
+rows), the converted pair is served from a small LRU cache instead.
+"""
+from collections import OrderedDict
+
+
+class BodyConverter:
+    """Personalized body source -> (html, plain text), remembering recent results."""
+
+    def __init__(self, to_html, to_plain, max_entries=128):
+        self.to_html = to_html
+        self.to_plain = to_plain
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def convert(self, source):
+        cached = self._cache.get(source)
+        if cached is not None:
+            self._cache.move_to_end(source)
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        html = self.to_html(source)
+        result = (html, self.to_plain(html))
+        if self.max_entries > 0:
+            self._cache[source] = result
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return result
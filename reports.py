@@ -0,0 +1,165 @@
+"""Per-recipient delivery reports, streamed to disk as a campaign runs.
+
+Every outcome is appended to a JSON-lines file instead of a list in memory;
+the job keeps only its counters, a ring buffer of recent lines for the live
+progress view and a compact index (two 8-byte numbers per entry) for paging
+through the file in CSV row order and exporting it as CSV.
+"""
+import csv
+import io
+import json
+import os
+import threading
+import time
+from array import array
+from collections import deque
+
+SENT = "sent"
+FAILED = "failed"
+SKIPPED = "skipped"
+NOTE = "note"
+
+CSV_COLUMNS = ("row", "email", "status", "message", "time")
+
+# Compact codes for the per-row outcomes remembered from earlier runs
+_STATUS_CODES = {SENT: 1, FAILED: 2, SKIPPED: 3}
+
+
+class DeliveryReport:
+    """Append-only JSONL log of one campaign's outcomes.
+
+    Reopening an existing file appends to it, so a resumed campaign's report
+    covers every run; a torn last line left by a crash is dropped. What the
+    earlier runs logged per row is kept (a byte per row) for ``logged_before``,
+    so a resumed run can avoid logging the same outcome twice.
+    """
+
+    def __init__(self, path, recent=200, flush_every=100, clock=time.time):
+        self.path = path
+        self.flush_every = flush_every
+        self.clock = clock
+        self._recent = deque(maxlen=recent)
+        self._offsets = array("Q")
+        self._rows = array("q")
+        self._row_order = None
+        self._earlier = bytearray() # Status code per row from earlier runs, 0 = none
+        self._unflushed = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._index_existing()
+        self._file = open(path, "ab")
+
+    def _index_existing(self):
+        if not os.path.exists(self.path):
+            return
+        offset = 0
+        with open(self.path, "rb") as f:
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(raw)
+                except ValueError:
+                    break
+                row = entry.get("row") or 0
+                self._offsets.append(offset)
+                self._rows.append(row)
+                offset += len(raw)
+                code = _STATUS_CODES.get(entry.get("status"))
+                if code and row > 0:
+                    if row >= len(self._earlier):
+                        self._earlier.extend(bytes(row + 1 - len(self._earlier)))
+                    self._earlier[row] = code
+        if offset != os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(offset)
+
+    def add(self, status, line, row_number=None, receiver=None, message=None):
+        """Append one entry; ``line`` is what the result page shows."""
+        entry = {"row": row_number, "email": receiver, "status": status,
+                 "message": message if message is not None else line, "line": line,
+                 "time": round(self.clock(), 3)}
+        data = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self._offsets.append(self._file.tell())
+            self._rows.append(row_number or 0)
+            self._file.write(data)
+            self._recent.append(line)
+            self._row_order = None
+            self._unflushed += 1
+            if self._unflushed >= self.flush_every:
+                self._file.flush()
+                self._unflushed = 0
+
+    def logged_before(self, row_number, status):
+        """Whether an earlier run of this report logged ``status`` for the row last."""
+        if not row_number or row_number >= len(self._earlier):
+            return False
+        return self._earlier[row_number] == _STATUS_CODES.get(status)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def recent(self, since=0):
+        """``(offset, lines)``: the retained lines from entry ``since`` on.
+
+        Lines that already fell out of the ring buffer are skipped, so
+        ``offset`` may be past ``since``.
+        """
+        with self._lock:
+            total = len(self._offsets)
+            first = total - len(self._recent)
+            start = max(since, first)
+            lines = list(self._recent)[start - first:] if start < total else []
+        return start, lines
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+            self._unflushed = 0
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def discard(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def entries(self, start=0, count=None):
+        """Entries in CSV row order (senders finish out of order), from position ``start``."""
+        self.flush()
+        with self._lock:
+            if self._row_order is None:
+                rows = self._rows
+                self._row_order = array("Q", sorted(range(len(rows)), key=rows.__getitem__))
+            order = self._row_order
+            offsets = self._offsets
+        stop = len(order) if count is None else min(len(order), start + count)
+        with open(self.path, "rb") as f:
+            for position in range(max(start, 0), stop):
+                f.seek(offsets[order[position]])
+                yield json.loads(f.readline())
+
+    def lines(self, start=0, count=None):
+        return [entry["line"] for entry in self.entries(start, count)]
+
+    def iter_csv(self, chunk_rows=500):
+        """The whole report as CSV text, in chunks (for a streamed download)."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_COLUMNS)
+        for i, entry in enumerate(self.entries(), 1):
+            writer.writerow([entry.get("row") or "", entry.get("email") or "", entry["status"],
+                             entry.get("message") or "",
+                             time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["time"]))])
+            if i % chunk_rows == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
@@ -0,0 +1,234 @@
+"""Reusable SMTP sessions for bulk sends.
+
+Opening a connection and running EHLO, STARTTLS and AUTH for every recipient
+costs more than the DATA phase on large campaigns, and relays throttle that
+kind of connection churn. SMTPConnectionPool keeps authenticated sessions open
+and hands them out for many messages, recycling each session after a
+configurable number of messages.
+"""
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import count_smtp_replies, timed
+
+# ``starttls`` value for servers that may or may not offer it (direct MX delivery)
+OPPORTUNISTIC_TLS = "opportunistic"
+
+
+def _close_quietly(server):
+    """QUIT politely, falling back to dropping the socket."""
+    try:
+        server.quit()
+    except Exception:
+        try:
+            server.close()
+        except Exception:
+            pass
+
+
+class PooledSMTPSession:
+    """One SMTP connection owned by a pool.
+
+    Connects lazily, counts the messages sent on it and reconnects when the
+    per-session cap is hit, when a NOOP keepalive fails, or when the server
+    drops an idle connection between messages.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.server = None
+        self.message_count = 0
+        self.last_used = 0.0
+
+    @property
+    def connected(self):
+        return self.server is not None
+
+    def connect(self):
+        self.close()
+        pool = self.pool
+        with timed(pool.metrics, "smtp_connect"):
+            server = pool.smtp_factory(host=pool.host, port=pool.port, timeout=pool.timeout)
+            try:
+                server.ehlo()
+                if pool.starttls == OPPORTUNISTIC_TLS:
+                    use_tls = server.has_extn("starttls")
+                else:
+                    use_tls = pool.starttls
+                if use_tls:
+                    server.starttls()
+                    server.ehlo() # Re-identify after starting TLS
+            except Exception:
+                _close_quietly(server)
+                raise
+        if pool.username:
+            try:
+                with timed(pool.metrics, "smtp_login"):
+                    server.login(user=pool.username, password=pool.password)
+            except Exception:
+                _close_quietly(server)
+                raise
+        self.server = server
+        self.message_count = 0
+        self.last_used = pool.clock()
+        pool.connections_opened += 1
+
+    def close(self):
+        if self.server is not None:
+            server, self.server = self.server, None
+            _close_quietly(server)
+
+    def ensure_ready(self):
+        """Make sure the session can take another message."""
+        pool = self.pool
+        if self.server is None:
+            self.connect()
+            return
+        if pool.max_messages and self.message_count >= pool.max_messages:
+            self.connect()
+            return
+        if pool.keepalive_interval is not None and pool.clock() - self.last_used >= pool.keepalive_interval:
+            try:
+                code, _ = self.server.noop()
+            except (smtplib.SMTPException, OSError):
+                code = None
+            if code != 250:
+                self.connect()
+            else:
+                self.last_used = pool.clock()
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        """Send one message, returning smtplib's dict of refused recipients.
+
+        A disconnect on a session that already carried mail usually means the
+        server timed it out while idle, so it is reopened and the message is
+        retried once. A disconnect on a fresh session is reported as-is.
+        """
+        self.ensure_ready()
+        reused = self.message_count > 0
+        metrics = self.pool.metrics
+        try:
+            with timed(metrics, "smtp_send"):
+                refused = self.server.sendmail(from_addr, to_addrs, msg)
+        except smtplib.SMTPServerDisconnected as e:
+            self.server = None
+            if not reused:
+                count_smtp_replies(metrics, error=e)
+                raise
+            self.pool.reconnects += 1
+            self.connect()
+            try:
+                with timed(metrics, "smtp_send"):
+                    refused = self._sendmail_once(from_addr, to_addrs, msg)
+            except Exception as retry_error:
+                count_smtp_replies(metrics, error=retry_error)
+                raise
+        except smtplib.SMTPResponseException as e:
+            count_smtp_replies(metrics, error=e)
+            # 421 means the server is closing the channel on us
+            if e.smtp_code == 421:
+                self.close()
+            raise
+        except smtplib.SMTPException as e:
+            # e.g. every recipient refused; smtplib has already reset the transaction
+            count_smtp_replies(metrics, error=e)
+            raise
+        except Exception as e:
+            count_smtp_replies(metrics, error=e)
+            # A dropped socket, or a failure (e.g. UnicodeEncodeError) somewhere
+            # mid-transaction: RSET could land inside DATA, so start over
+            self.close()
+            raise
+        count_smtp_replies(metrics, refused)
+        self.message_count += 1
+        self.last_used = self.pool.clock()
+        return refused
+
+    def _sendmail_once(self, from_addr, to_addrs, msg):
+        try:
+            return self.server.sendmail(from_addr, to_addrs, msg)
+        except smtplib.SMTPResponseException as e:
+            if e.smtp_code == 421:
+                self.close()
+            raise
+        except smtplib.SMTPServerDisconnected:
+            self.close()
+            raise
+        except smtplib.SMTPException:
+            raise
+        except Exception:
+            self.close()
+            raise
+
+
+class SMTPConnectionPool:
+    """A bounded set of reusable, authenticated SMTP sessions.
+
+    ``size`` caps how many sessions may be checked out at once. Sessions are
+    returned to the pool after use and handed out again most-recently-used
+    first, so a single-threaded campaign keeps reusing one warm connection.
+    """
+
+    def __init__(self, host, port, username=None, password=None, size=1,
+                 max_messages=100, keepalive_interval=30, timeout=30,
+                 starttls=None, smtp_factory=smtplib.SMTP, clock=time.monotonic, metrics=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = max(1, int(size))
+        self.max_messages = max_messages
+        self.keepalive_interval = keepalive_interval
+        self.timeout = timeout
+        # STARTTLS unless on the implicit TLS port
+        self.starttls = port != 465 if starttls is None else starttls
+        self.smtp_factory = smtp_factory
+        self.clock = clock
+        # Optional metrics.PipelineMetrics for connect/login/send timings and reply codes
+        self.metrics = metrics
+
+        self.connections_opened = 0
+        self.reconnects = 0
+
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._closed = False
+
+    @contextmanager
+    def session(self):
+        """Check out a session for as long as the ``with`` block runs."""
+        if self._closed:
+            raise RuntimeError("SMTP connection pool is closed")
+        self._slots.acquire()
+        with self._lock:
+            session = self._idle.pop() if self._idle else PooledSMTPSession(self)
+        try:
+            yield session
+        finally:
+            with self._lock:
+                keep = not self._closed and session.connected
+                if keep:
+                    self._idle.append(session)
+            if not keep:
+                session.close()
+            self._slots.release()
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        with self.session() as session:
+            return session.sendmail(from_addr, to_addrs, msg)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for session in idle:
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,156 @@
+"""Send-rate limiting and adaptive concurrency for SMTP relays.
+
+Providers such as MailerSend enforce per-second, per-minute and per-day
+quotas and answer with 421/451 when they are exceeded. RateLimiter keeps the
+send rate under the configured quotas with token buckets, and
+AdaptiveConcurrency halves the number of parallel sends whenever the relay
+pushes back, growing it again slowly while sends succeed.
+
+Both take an injectable clock (and RateLimiter a sleep function) so they can
+be driven deterministically.
+"""
+import smtplib
+import threading
+import time
+
+
+class TokenBucket:
+    """``rate`` tokens per ``period`` seconds, holding at most ``capacity``.
+
+    The bucket starts full, so up to ``capacity`` sends may go out at once.
+    """
+
+    def __init__(self, rate, period, capacity=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.period = float(period)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def _refill(self, now):
+        elapsed = max(0.0, now - self.updated)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate / self.period)
+        self.updated = now
+
+    def wait_time(self, now=None, tokens=1):
+        """Seconds until ``tokens`` are available (0 when they are available now).
+
+        A request larger than the bucket only waits for a full bucket and
+        then overdraws it, so the debt is paid off before the next send.
+        """
+        self._refill(self.clock() if now is None else now)
+        needed = min(tokens, self.capacity)
+        # Tolerate float rounding, or a refill that lands a hair under one
+        # token could ask for a wait too small to ever advance the clock
+        if self.tokens >= needed - 1e-9:
+            return 0.0
+        return (needed - self.tokens) * self.period / self.rate
+
+    def take(self, tokens=1):
+        self.tokens -= tokens
+
+
+class RateLimiter:
+    """Blocks senders so every configured quota is respected at once.
+
+    Any limit left as None (or 0) is not enforced. One limiter should be
+    shared by everything that sends through the same account.
+    """
+
+    def __init__(self, per_second=None, per_minute=None, per_day=None,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.buckets = []
+        for limit, period in ((per_second, 1), (per_minute, 60), (per_day, 86400)):
+            if limit:
+                self.buckets.append(TokenBucket(limit, period, clock=clock))
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.buckets)
+
+    def try_acquire(self, tokens=1):
+        """Take ``tokens`` from every bucket if all have them.
+
+        Returns 0 on success, otherwise the seconds to wait before trying
+        again (nothing is taken in that case).
+        """
+        with self._lock:
+            now = self.clock()
+            wait = max((bucket.wait_time(now, tokens) for bucket in self.buckets), default=0.0)
+            if wait > 0:
+                return wait
+            for bucket in self.buckets:
+                bucket.take(tokens)
+            return 0.0
+
+    def acquire(self, tokens=1):
+        """Block until ``tokens`` sends (recipients) are allowed; returns the time waited."""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return waited
+            self.sleep(wait)
+            waited += wait
+
+
+class AdaptiveConcurrency:
+    """AIMD cap on in-flight sends.
+
+    ``backoff()`` (called on a transient 4xx reply) halves the cap, and every
+    ``limit`` successes in a row raise it by one, up to ``max_limit``.
+    """
+
+    def __init__(self, max_limit, min_limit=1):
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def succeeded(self):
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_limit:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    def backoff(self):
+        with self._cond:
+            self.limit = max(self.min_limit, self.limit // 2)
+            self._successes = 0
+
+
+def smtp_error_code(exc):
+    """The SMTP reply code behind an smtplib exception, if there is one."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in exc.recipients.values()]
+        # Only meaningful when every recipient got the same class of reply
+        if codes and all(code // 100 == codes[0] // 100 for code in codes):
+            return codes[0]
+        return None
+    return getattr(exc, "smtp_code", None)
+
+
+def is_transient_smtp_error(exc):
+    """True for failures worth retrying later: 4xx replies and dropped connections."""
+    if isinstance(exc, smtplib.SMTPServerDisconnected):
+        return True
+    code = smtp_error_code(exc)
+    return code is not None and 400 <= code < 500
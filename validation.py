@@ -0,0 +1,198 @@
+"""Pre-send recipient checks: address syntax, normalization, duplicates, suppression.
+
+Runs while the CSV is streamed, before anything is rendered, so a malformed,
+repeated or suppressed address costs a regex match and a hash lookup rather
+than an SMTP round trip. Duplicates and suppressed addresses are compared by
+a 64-bit fingerprint of the case-folded address, which keeps the indexes
+small enough for lists of millions of rows.
+"""
+import hashlib
+import math
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_left
+
+# Reasons RecipientValidator.check gives for leaving a recipient out
+INVALID = "invalid"
+DUPLICATE = "duplicate"
+SUPPRESSED = "suppressed"
+
+MAX_ADDRESS_LENGTH = 254
+MAX_LOCAL_PART_LENGTH = 64
+
+# RFC 5322 dot-atom local part and an RFC 1035 style domain with at least two
+# labels and a non-numeric TLD. Quoted local parts and address literals are
+# not accepted. Neither SMTP transport speaks SMTPUTF8, so addresses must be
+# ASCII; normalize_address IDNA-encodes internationalized domains first.
+_ATEXT = "A-Za-z0-9!#$%&'*+/=?^_`{|}~\\-"
+_LABEL = "[A-Za-z0-9](?:[A-Za-z0-9\\-]{0,61}[A-Za-z0-9])?"
+EMAIL_PATTERN = re.compile(
+    rf"[{_ATEXT}]+(?:\.[{_ATEXT}]+)*@(?:{_LABEL}\.)+(?![0-9]+\Z){_LABEL}", re.ASCII
+)
+
+
+def normalize_address(address):
+    """Trim whitespace and angle brackets, lowercase the domain and IDNA-encode it.
+
+    The local part keeps its case: it is the receiving server's to interpret.
+    A domain that cannot be IDNA-encoded is left as it is (and fails
+    is_valid_address).
+    """
+    address = (address or "").strip().strip("<>").strip()
+    local, at, domain = address.rpartition("@")
+    if not at:
+        return address
+    domain = domain.rstrip('.').lower()
+    if not domain.isascii():
+        try:
+            domain = domain.encode("idna").decode("ascii")
+        except UnicodeError:
+            pass
+    return f"{local}@{domain}"
+
+
+def is_valid_address(address):
+    """RFC-lite syntax check of a normalized address."""
+    if len(address) > MAX_ADDRESS_LENGTH or not EMAIL_PATTERN.fullmatch(address):
+        return False
+    return address.rindex("@") <= MAX_LOCAL_PART_LENGTH
+
+
+def address_key(address):
+    """64-bit fingerprint of an address, ignoring case."""
+    digest = hashlib.blake2b(address.casefold().encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class SeenAddresses:
+    """Exact duplicate detection over address fingerprints."""
+
+    probabilistic = False
+
+    def __init__(self):
+        self._seen = set()
+
+    def add(self, key):
+        """Record ``key``; True if it had been recorded before."""
+        if key in self._seen:
+            return True
+        self._seen.add(key)
+        return False
+
+
+class BloomFilter:
+    """Fixed-size duplicate detection for very large lists.
+
+    Uses about 29 bits per address at the default error rate, but reports a
+    new address as already seen with probability ``error_rate``.
+    """
+
+    probabilistic = True
+
+    def __init__(self, capacity, error_rate=1e-6):
+        capacity = max(1, int(capacity))
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def add(self, key):
+        """Record ``key``; True if it was (probably) recorded before."""
+        # Double hashing from the two halves of the fingerprint
+        h1, h2 = key & 0xFFFFFFFF, (key >> 32) | 1
+        bits = self._bits
+        seen = True
+        for i in range(self.hashes):
+            bit = (h1 + i * h2) % self.size
+            mask = 1 << (bit & 7)
+            if not bits[bit >> 3] & mask:
+                bits[bit >> 3] |= mask
+                seen = False
+        return seen
+
+
+class SuppressionList:
+    """Addresses never to send to, as a sorted array of fingerprints (8 bytes each).
+
+    Entries of the form ``@example.com`` suppress a whole domain.
+    """
+
+    def __init__(self, addresses=(), domains=()):
+        self._keys = array("Q", sorted({address_key(normalize_address(a)) for a in addresses}))
+        self.domains = frozenset(domain.lower().lstrip("@") for domain in domains)
+
+    @classmethod
+    def load(cls, path):
+        """Read one address (or ``@domain``) per line; the first CSV field is used and ``#`` starts a comment."""
+        addresses, domains = [], []
+        with open(path, encoding="utf-8-sig") as f:
+            for line in f:
+                entry = line.split("#", 1)[0].split(",", 1)[0].strip().strip('"')
+                if entry.startswith("@"):
+                    domains.append(entry)
+                elif "@" in entry:
+                    addresses.append(entry)
+        return cls(addresses, domains)
+
+    def __len__(self):
+        return len(self._keys) + len(self.domains)
+
+    def matches(self, address, key=None):
+        key = address_key(address) if key is None else key
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return True
+        return bool(self.domains) and address.rpartition("@")[2].lower() in self.domains
+
+    def __contains__(self, address):
+        return self.matches(normalize_address(address))
+
+
+_suppression_cache = {}
+_suppression_lock = threading.Lock()
+
+
+def load_suppression_list(path):
+    """SuppressionList for ``path``, read once and reused until the file changes."""
+    mtime = os.stat(path).st_mtime_ns
+    with _suppression_lock:
+        cached = _suppression_cache.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = _suppression_cache[path] = (mtime, SuppressionList.load(path))
+        return cached[1]
+
+
+class RecipientValidator:
+    """Checks one campaign's recipients in a single streaming pass.
+
+    Duplicates are tracked exactly, or with a BloomFilter once
+    ``expected_rows`` exceeds ``bloom_above_rows`` (0 never switches).
+    """
+
+    def __init__(self, deduplicate=True, suppression=None, expected_rows=None,
+                 bloom_above_rows=0, bloom_error_rate=1e-6):
+        self.suppression = suppression
+        if not deduplicate:
+            self._seen = None
+        elif bloom_above_rows and expected_rows and expected_rows > bloom_above_rows:
+            self._seen = BloomFilter(expected_rows, bloom_error_rate)
+        else:
+            self._seen = SeenAddresses()
+
+    @property
+    def probabilistic(self):
+        """True when duplicates are detected with a Bloom filter (and may be false positives)."""
+        return self._seen is not None and self._seen.probabilistic
+
+    def check(self, address):
+        """``(normalized address, reason)``; ``reason`` is None for a recipient to send to."""
+        address = normalize_address(address)
+        if not is_valid_address(address):
+            return address, INVALID
+        key = address_key(address)
+        if self.suppression is not None and self.suppression.matches(address, key):
+            return address, SUPPRESSED
+        if self._seen is not None and self._seen.add(key):
+            return address, DUPLICATE
+        return address, None